@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+"""Micro-benchmark: response/payload decoding paths.
+
+Compares validated UserResponse.from_json with the trusted (validation-free)
+read path over large, realistic response_json values, and per-render
+json.loads of a payload with the request_id-keyed payload cache.
+
+    python benchmarks/json_codec.py [-n 200]
+"""
+import argparse
+import base64
+import json
+import os
+import time
+
+from cuemcp import codec
+from cuemcp.models import UserResponse
+from cuemcp.terminal_render import render_payload
+
+
+def _large_text() -> str:
+    para = (
+        "Deployed build 1432 to staging; 3 flaky tests quarantined. "
+        "已完成登录模块重构，数据库迁移脚本待确认。Next: run load test against /api/v2/orders.\n"
+    )
+    return para * 400  # ~50 KB of mixed ASCII/CJK text
+
+
+def _samples() -> dict[str, str]:
+    text = _large_text()
+    mentions = [
+        {"userId": f"agent{i}", "start": i * 10, "length": 6, "display": f"@agent{i}"}
+        for i in range(50)
+    ]
+    # Legacy rows (pre-file storage) inlined images as base64.
+    images = [
+        {"mime_type": "image/png", "base64_data": base64.b64encode(os.urandom(256 * 1024)).decode()}
+        for _ in range(4)
+    ]
+    return {
+        "text ~50KB": json.dumps({"text": text}, ensure_ascii=False),
+        "text + mentions": json.dumps({"text": text, "mentions": mentions}, ensure_ascii=False),
+        "legacy 4x256KB images": json.dumps({"text": text, "images": images}),
+    }
+
+
+def _time(fn, n: int) -> float:
+    start = time.perf_counter()
+    for _ in range(n):
+        fn()
+    return (time.perf_counter() - start) / n * 1e6
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("-n", type=int, default=200, help="iterations per measurement")
+    args = parser.parse_args()
+
+    print(f"orjson available: {codec._ORJSON_AVAILABLE}")
+    print(f"{'response_json':<24} {'size':>10} {'validated':>12} {'trusted':>12}")
+    for label, raw in _samples().items():
+        validated = _time(lambda: UserResponse.from_json(raw), args.n)
+        trusted = _time(lambda: UserResponse.from_trusted_json(raw), args.n)
+        print(f"{label:<24} {len(raw):>9}B {validated:>10.1f}us {trusted:>10.1f}us")
+
+    payload = json.dumps(
+        {
+            "type": "form",
+            "fields": [
+                {"label": f"Field {i}", "kind": "text", "options": [f"opt{j}" for j in range(8)]}
+                for i in range(40)
+            ],
+        }
+    )
+    uncached = _time(lambda: render_payload(payload), args.n * 10)
+    cached = _time(lambda: render_payload(payload, request_id="req_bench"), args.n * 10)
+    print(f"\nrender_payload (form, {len(payload)}B): uncached {uncached:.1f}us, cached {cached:.1f}us")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+"""Micro-benchmark: ORM load/modify/save vs statement-level request lifecycle.
+
+Runs create -> complete and create -> cancel for N requests against a
+throwaway SQLite file and prints rows per second for each path.
+
+    python benchmarks/write_path.py [-n 2000]
+"""
+import argparse
+import tempfile
+import time
+import uuid
+from datetime import datetime
+from pathlib import Path
+
+from sqlmodel import Session, SQLModel, create_engine, select
+
+from cuemcp.models import CueRequest, CueResponse, RequestStatus, UserResponse
+from cuemcp.store import cancel_request, complete_request, create_request
+
+
+def _orm_create(engine, request_id: str) -> None:
+    with Session(engine) as session:
+        session.add(CueRequest(request_id=request_id, agent_id="bench", prompt="hello"))
+        session.commit()
+
+
+def _orm_complete(engine, request_id: str) -> None:
+    with Session(engine) as session:
+        session.add(CueResponse.create(request_id, UserResponse(text="ok")))
+        db_request = session.exec(
+            select(CueRequest).where(CueRequest.request_id == request_id)
+        ).first()
+        if db_request:
+            db_request.status = RequestStatus.COMPLETED
+            db_request.updated_at = datetime.now()
+            session.add(db_request)
+        session.commit()
+
+
+def _orm_cancel(engine, request_id: str) -> None:
+    with Session(engine) as session:
+        existing = session.exec(
+            select(CueResponse).where(CueResponse.request_id == request_id)
+        ).first()
+        if not existing:
+            session.add(CueResponse.create(request_id, UserResponse(text=""), cancelled=True))
+        db_request = session.exec(
+            select(CueRequest).where(CueRequest.request_id == request_id)
+        ).first()
+        if db_request:
+            db_request.status = RequestStatus.CANCELLED
+            db_request.updated_at = datetime.now()
+            session.add(db_request)
+        session.commit()
+
+
+def _run(label: str, engine, n: int, create, finish) -> None:
+    ids = [f"req_{uuid.uuid4().hex[:12]}" for _ in range(n)]
+    start = time.perf_counter()
+    for rid in ids:
+        create(engine, rid)
+    for rid in ids:
+        finish(engine, rid)
+    elapsed = time.perf_counter() - start
+    print(f"{label:<28} {n:>6} requests  {elapsed:7.3f}s  {2 * n / elapsed:10.0f} rows/s")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("-n", type=int, default=2000, help="requests per scenario")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        engine = create_engine(f"sqlite:///{Path(tmp) / 'bench.db'}", echo=False)
+        SQLModel.metadata.create_all(engine)
+
+        def stmt_create(e, rid):
+            create_request(e, rid, "bench", "hello")
+
+        def stmt_complete(e, rid):
+            complete_request(e, rid, UserResponse(text="ok"))
+
+        _run("orm complete (before)", engine, args.n, _orm_create, _orm_complete)
+        _run("statement complete (after)", engine, args.n, stmt_create, stmt_complete)
+        _run("orm cancel (before)", engine, args.n, _orm_create, _orm_cancel)
+        _run("statement cancel (after)", engine, args.n, stmt_create, cancel_request)
+        engine.dispose()
+
+
+if __name__ == "__main__":
+    main()
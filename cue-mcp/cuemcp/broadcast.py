@@ -0,0 +1,100 @@
+"""Group broadcast: answer every waiting member of a group with one reply."""
+import argparse
+import base64
+import mimetypes
+import sys
+from pathlib import Path
+
+from sqlalchemy import text
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import OperationalError
+from sqlmodel import SQLModel, create_engine
+
+from .models import ImageContent, UserResponse
+from .routing import ShardRouter, sharding_enabled
+from .store import ensure_request_schema, respond_to_group
+
+DEFAULT_DB_PATH = Path.home() / ".cue/cue.db"
+
+
+def _read_images(paths: list[str]) -> list[ImageContent]:
+    images: list[ImageContent] = []
+    for p in paths:
+        path = Path(p).expanduser()
+        mime, _ = mimetypes.guess_type(str(path))
+        if not mime or not mime.startswith("image/"):
+            raise SystemExit(f"not an image: {path}")
+        images.append(
+            ImageContent(mime_type=mime, base64_data=base64.b64encode(path.read_bytes()).decode("utf-8"))
+        )
+    return images
+
+
+def _group_members(engine: Engine, group_id: str) -> list[str]:
+    try:
+        with engine.connect() as conn:
+            rows = conn.execute(
+                text("SELECT agent_name FROM group_members WHERE group_id = :group_id"), {"group_id": group_id}
+            )
+            return [str(r[0]) for r in rows]
+    except OperationalError:
+        return []  # group_members is created by cue-console
+
+
+def broadcast(
+    engine: Engine,
+    group_id: str,
+    response: UserResponse,
+    cancelled: bool = False,
+    *,
+    sharded: bool = False,
+) -> int:
+    """respond_to_group on the main DB, plus every shard holding group members when sharded."""
+    resolved = respond_to_group(engine, group_id, response, cancelled=cancelled)
+    if not sharded:
+        return resolved
+    router = ShardRouter(engine, enabled=True)
+    by_shard: dict[Engine, list[str]] = {}
+    for agent_id in _group_members(engine, group_id):
+        # Members without a recorded shard have no sharded requests to resolve.
+        shard = router.recorded_engine_for_agent(agent_id)
+        if shard is not None and shard is not engine:
+            by_shard.setdefault(shard, []).append(agent_id)
+    for shard, members in by_shard.items():
+        resolved += respond_to_group(shard, group_id, response, cancelled=cancelled, members=members)
+    return resolved
+
+
+def main(argv: list[str] | None = None) -> None:
+    parser = argparse.ArgumentParser(
+        prog="cuemcp broadcast",
+        description="Resolve every pending request from a group's member agents with one reply.",
+    )
+    parser.add_argument("group_id", help="Group id (cue-console groups.id)")
+    parser.add_argument("text", nargs="?", default="-", help="Reply text, '-' to read stdin (default)")
+    parser.add_argument("--image", action="append", default=[], help="Attach an image (repeatable)")
+    parser.add_argument("--cancel", action="store_true", help="Send as 'did not continue' instead of a reply")
+    parser.add_argument("--db", default=str(DEFAULT_DB_PATH), help="SQLite DB path (default: ~/.cue/cue.db)")
+    args = parser.parse_args(argv)
+
+    db_path = Path(args.db).expanduser()
+    if not db_path.exists():
+        parser.error(f"database not found: {db_path}")
+
+    reply_text = sys.stdin.read() if args.text == "-" else args.text
+    response = UserResponse(text=reply_text.strip(), images=_read_images(args.image))
+
+    engine = create_engine(f"sqlite:///{db_path}", echo=False)
+    try:
+        SQLModel.metadata.create_all(engine)
+        ensure_request_schema(engine)
+        # Shards belong to the live ~/.cue/cue.db, not to a DB passed with --db.
+        sharded = sharding_enabled() and db_path.resolve() == DEFAULT_DB_PATH.resolve()
+        resolved = broadcast(engine, args.group_id, response, cancelled=args.cancel, sharded=sharded)
+    finally:
+        engine.dispose()
+    print(f"[MCP] Resolved {resolved} pending requests in group {args.group_id}")
+
+
+if __name__ == "__main__":
+    main()
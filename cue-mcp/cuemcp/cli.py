@@ -0,0 +1,36 @@
+"""`cuemcp` entry point.
+
+Subcommands only import what they need: importing ``server`` opens and
+migrates ``~/.cue/cue.db``, which a command pointed at another DB (``--db``)
+must not touch.
+"""
+import sys
+
+
+def main() -> None:
+    argv = sys.argv[1:]
+    command = argv[0] if argv else ""
+    if command == "export":
+        from .export import main as export_main
+
+        export_main(argv[1:])
+    elif command == "broadcast":
+        from .broadcast import main as broadcast_main
+
+        broadcast_main(argv[1:])
+    elif command == "rebuild-summaries":
+        from .summary import main as summary_main
+
+        summary_main(argv[1:])
+    elif command == "compress":
+        from .compression import main as compression_main
+
+        compression_main(argv[1:])
+    else:
+        from .server import main as server_main
+
+        server_main()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+"""JSON codec for payloads and stored responses.
+
+Uses orjson when it is installed (``pip install orjson``) and falls back to the
+standard library otherwise. Payloads are parsed once per request and cached by
+request_id, since the same pending request is rendered over and over.
+"""
+import json
+from collections import OrderedDict
+from typing import Any
+
+try:
+    import orjson
+
+    _ORJSON_AVAILABLE = True
+except Exception:
+    _ORJSON_AVAILABLE = False
+
+PAYLOAD_CACHE_SIZE = 1024
+
+
+def loads(data: str | bytes) -> Any:
+    """Parse JSON text. Raises ValueError on malformed input."""
+    if _ORJSON_AVAILABLE:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def dumps(obj: Any) -> str:
+    """Serialize to compact JSON text (non-ASCII kept as-is)."""
+    if _ORJSON_AVAILABLE:
+        return orjson.dumps(obj).decode("utf-8")
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":"))
+
+
+class _Invalid:
+    __slots__ = ("error",)
+
+    def __init__(self, error: Exception):
+        self.error = error
+
+
+_payload_cache: "OrderedDict[str, tuple[str, Any]]" = OrderedDict()
+
+
+def parse_payload(payload: str, request_id: str | None = None) -> Any:
+    """Parse a payload JSON string, cached by request_id when given.
+
+    The cached entry is only reused while the payload text is unchanged.
+    Raises ValueError for malformed payloads (also cached).
+    """
+    if request_id is not None:
+        hit = _payload_cache.get(request_id)
+        if hit is not None and hit[0] == payload:
+            _payload_cache.move_to_end(request_id)
+            parsed = hit[1]
+            if isinstance(parsed, _Invalid):
+                raise ValueError(str(parsed.error))
+            return parsed
+
+    try:
+        parsed = loads(payload)
+    except ValueError as e:
+        parsed = _Invalid(e)
+
+    if request_id is not None:
+        _payload_cache[request_id] = (payload, parsed)
+        if len(_payload_cache) > PAYLOAD_CACHE_SIZE:
+            _payload_cache.popitem(last=False)
+
+    if isinstance(parsed, _Invalid):
+        raise ValueError(str(parsed.error))
+    return parsed
+
+
+def clear_payload_cache() -> None:
+    _payload_cache.clear()
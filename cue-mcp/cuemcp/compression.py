@@ -0,0 +1,347 @@
+"""Opt-in transparent compression of large prompt / payload / response text.
+
+With ``CUE_COMPRESSION=1``, values of at least ``CUE_COMPRESSION_MIN_BYTES``
+(default 1024) UTF-8 bytes are stored as a BLOB: the ``CUEZ`` magic, a format
+byte, the original size (4 bytes, big endian) and the zlib stream. Anything
+else is stored as plain text, so old and new rows mix freely in one table.
+
+Only cuemcp decodes these values; cue-console and cueme read the columns as
+text. So compression is decided per engine: the ShardRouter registers shard
+engines with ``enable_compression`` when the env var is on, and writes to any
+other engine (the main ``~/.cue/cue.db`` in particular) stay plain text.
+Archives are compressed explicitly with ``cuemcp compress --db``.
+
+Compressed prompts are indexed in ``cue_prompt_fts``, a contentless FTS5
+trigram index (no second copy of the text), so recall() substring search
+still finds them. Its rowids are ``cue_prompt_entries`` ids (AUTOINCREMENT,
+never reused) that map to ``request_id``; a trigger drops the entry when the
+console deletes a request, so stale postings can never match another request.
+
+Values are decoded when a row is loaded, not on attribute access: ORM objects
+here are read after their session closes, where deferred loading would fail.
+Queries that do not need the text select only the columns they use.
+"""
+import argparse
+import os
+import struct
+import weakref
+import zlib
+from pathlib import Path
+
+from sqlalchemy import create_engine, text
+from sqlalchemy.engine import Connection, Engine
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.types import Text, TypeDecorator
+
+DEFAULT_DB_PATH = Path.home() / ".cue/cue.db"
+
+MAGIC = b"CUEZ\x01"
+_HEADER = struct.Struct(">I")
+_HEADER_LEN = len(MAGIC) + _HEADER.size
+
+PROMPT_INDEX = "cue_prompt_fts"
+PROMPT_ENTRIES = "cue_prompt_entries"
+
+# (table, column) pairs that may hold compressed values.
+COMPRESSED_COLUMNS = (
+    ("cue_requests", "prompt"),
+    ("cue_requests", "payload"),
+    ("cue_responses", "response_json"),
+    ("cue_group_responses", "response_json"),
+)
+
+
+def compression_enabled() -> bool:
+    return os.environ.get("CUE_COMPRESSION", "").strip().lower() in ("1", "true", "yes", "on")
+
+
+def compression_min_bytes() -> int:
+    try:
+        return max(64, int(os.environ.get("CUE_COMPRESSION_MIN_BYTES", "1024")))
+    except ValueError:
+        return 1024
+
+
+# Engines whose writes may be compressed; never the main DB (see enable_compression).
+_compressing_engines: "weakref.WeakSet[Engine]" = weakref.WeakSet()
+
+
+def enable_compression(engine: Engine) -> None:
+    """Compress large values written to ``engine`` (a shard or archive, not a DB the console reads)."""
+    if not ensure_prompt_index(engine):
+        print("[MCP] SQLite lacks FTS5 trigram support; prompts will be stored uncompressed")
+    _compressing_engines.add(engine)
+
+
+def compresses(engine: Engine) -> bool:
+    return engine in _compressing_engines
+
+
+def compress_for(engine: Engine, value: str | None) -> str | bytes | None:
+    """compress_text for engines registered with enable_compression; others get the value unchanged."""
+    return compress_text(value) if compresses(engine) else value
+
+
+def compress_text(value: str | None, *, min_bytes: int | None = None) -> str | bytes | None:
+    """Compressed BLOB for a large value, else the value unchanged."""
+    if not isinstance(value, str):
+        return value
+    raw = value.encode("utf-8")
+    if len(raw) < (min_bytes if min_bytes is not None else compression_min_bytes()):
+        return value
+    packed = MAGIC + _HEADER.pack(len(raw)) + zlib.compress(raw, 6)
+    return packed if len(packed) < len(raw) else value
+
+
+def is_compressed(value) -> bool:
+    return isinstance(value, (bytes, bytearray, memoryview)) and bytes(value[: len(MAGIC)]) == MAGIC
+
+
+def decompress_text(value):
+    """Inverse of compress_text; plain text (and None) passes through."""
+    if value is None or isinstance(value, str):
+        return value
+    data = bytes(value)
+    if data[: len(MAGIC)] == MAGIC:
+        return zlib.decompress(data[_HEADER_LEN:]).decode("utf-8")
+    return data.decode("utf-8", errors="replace")
+
+
+def original_size(header: bytes) -> int:
+    """Uncompressed byte size from the first _HEADER_LEN bytes of a compressed value."""
+    return _HEADER.unpack_from(header, len(MAGIC))[0]
+
+
+class CompressedText(TypeDecorator):
+    """Text column that decodes compressed values on load.
+
+    Writes go through the store's statements, which compress per engine
+    (compress_for). Decoding happens in the result processor, for every row
+    and column a query selects; select narrower columns to skip it.
+    """
+
+    impl = Text
+    cache_ok = True
+
+    def process_result_value(self, value, dialect):
+        return decompress_text(value)
+
+    def coerce_compared_value(self, op, value):
+        # LIKE/= operands are search terms, never stored values.
+        return Text()
+
+
+def ensure_prompt_index(engine: Engine) -> bool:
+    """Create the recall index for compressed prompts. False if SQLite lacks FTS5 trigram."""
+    try:
+        with engine.begin() as conn:
+            conn.execute(
+                text(
+                    f"CREATE VIRTUAL TABLE IF NOT EXISTS {PROMPT_INDEX} "
+                    "USING fts5(prompt, content='', tokenize='trigram')"
+                )
+            )
+            conn.execute(
+                text(
+                    f"CREATE TABLE IF NOT EXISTS {PROMPT_ENTRIES} ("
+                    "id INTEGER PRIMARY KEY AUTOINCREMENT, request_id TEXT NOT NULL UNIQUE)"
+                )
+            )
+            # Plain SQL only: the console's SQLite must be able to run it without FTS5.
+            conn.execute(
+                text(
+                    "CREATE TRIGGER IF NOT EXISTS trg_cue_prompt_entries_request_delete "
+                    "AFTER DELETE ON cue_requests BEGIN "
+                    f"DELETE FROM {PROMPT_ENTRIES} WHERE request_id = OLD.request_id; "
+                    "END"
+                )
+            )
+    except OperationalError:
+        return False
+    return True
+
+
+def has_prompt_index(conn: Connection) -> bool:
+    return conn.execute(
+        text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = :name"), {"name": PROMPT_ENTRIES}
+    ).fetchone() is not None
+
+
+def index_prompt(conn: Connection, request_id: str, prompt: str) -> None:
+    entry_id = conn.execute(
+        text(
+            f"INSERT INTO {PROMPT_ENTRIES} (request_id) VALUES (:request_id) "
+            "ON CONFLICT (request_id) DO NOTHING RETURNING id"
+        ),
+        {"request_id": request_id},
+    ).scalar()
+    if entry_id:
+        conn.execute(
+            text(f"INSERT INTO {PROMPT_INDEX} (rowid, prompt) VALUES (:rowid, :prompt)"),
+            {"rowid": entry_id, "prompt": prompt},
+        )
+
+
+def search_prompt_index(engine: Engine, hints: str) -> int | None:
+    """cue_requests.id of the newest compressed prompt containing ``hints`` (3+ chars)."""
+    if len(hints) < 3:
+        return None  # Trigram index cannot match shorter terms
+    query = '"' + hints.replace('"', '""') + '"'
+    try:
+        with engine.connect() as conn:
+            row = conn.execute(
+                text(
+                    f"SELECT r.id FROM {PROMPT_INDEX} f "
+                    f"JOIN {PROMPT_ENTRIES} e ON e.id = f.rowid "
+                    "JOIN cue_requests r ON r.request_id = e.request_id "
+                    f"WHERE {PROMPT_INDEX} MATCH :q AND r.agent_id != '' "
+                    "ORDER BY r.created_at DESC LIMIT 1"
+                ),
+                {"q": query},
+            ).fetchone()
+    except OperationalError:
+        return None
+    return int(row[0]) if row else None
+
+
+def compress_existing(engine: Engine, *, min_bytes: int | None = None, batch_size: int = 200) -> int:
+    """Compress every large plain-text value in place. Returns the number of values rewritten.
+
+    Walks each table by primary key in short transactions so concurrent
+    writers are not blocked for the whole run.
+    """
+    min_bytes = compression_min_bytes() if min_bytes is None else min_bytes
+    has_index = ensure_prompt_index(engine)
+    rewritten = 0
+    for table, column in COMPRESSED_COLUMNS:
+        if table == "cue_requests" and column == "prompt" and not has_index:
+            print("[MCP] SQLite lacks FTS5 trigram support; leaving prompts uncompressed")
+            continue
+        last_id = 0
+        while True:
+            with engine.begin() as conn:
+                try:
+                    rows = conn.execute(
+                        text(
+                            f"SELECT id, {column} FROM {table} "
+                            f"WHERE id > :last_id AND typeof({column}) = 'text' "
+                            f"AND length(CAST({column} AS BLOB)) >= :min_bytes "
+                            "ORDER BY id LIMIT :limit"
+                        ),
+                        {"last_id": last_id, "min_bytes": min_bytes, "limit": batch_size},
+                    ).fetchall()
+                except OperationalError:
+                    break  # Table not created in this DB
+                if not rows:
+                    break
+                for row_id, value in rows:
+                    packed = compress_text(value, min_bytes=min_bytes)
+                    if packed is value:
+                        continue  # Incompressible
+                    conn.execute(
+                        text(f"UPDATE {table} SET {column} = :value WHERE id = :id"),
+                        {"value": packed, "id": row_id},
+                    )
+                    if column == "prompt":
+                        request_id = conn.execute(
+                            text("SELECT request_id FROM cue_requests WHERE id = :id"), {"id": row_id}
+                        ).scalar_one()
+                        index_prompt(conn, request_id, value)
+                    rewritten += 1
+                last_id = rows[-1][0]
+    return rewritten
+
+
+def compression_stats(engine: Engine) -> list[dict]:
+    """Per column: row counts, stored bytes and the uncompressed size of compressed rows."""
+    stats: list[dict] = []
+    with engine.connect() as conn:
+        for table, column in COMPRESSED_COLUMNS:
+            try:
+                rows, stored = conn.execute(
+                    text(f"SELECT COUNT(*), COALESCE(SUM(length(CAST({column} AS BLOB))), 0) FROM {table}")
+                ).one()
+            except OperationalError:
+                continue
+            compressed = 0
+            compressed_stored = 0
+            original = 0
+            for header, size in conn.execute(
+                text(
+                    f"SELECT substr({column}, 1, {_HEADER_LEN}), length({column}) FROM {table} "
+                    f"WHERE typeof({column}) = 'blob'"
+                )
+            ):
+                if not is_compressed(header):
+                    continue
+                compressed += 1
+                compressed_stored += int(size)
+                original += original_size(bytes(header))
+            stats.append(
+                {
+                    "column": f"{table}.{column}",
+                    "rows": int(rows),
+                    "compressed_rows": compressed,
+                    "stored_bytes": int(stored),
+                    "saved_bytes": original - compressed_stored,
+                }
+            )
+    return stats
+
+
+def _fmt_bytes(n: int) -> str:
+    for unit in ("B", "KB", "MB"):
+        if abs(n) < 1024:
+            return f"{n:.0f}{unit}" if unit == "B" else f"{n:.1f}{unit}"
+        n /= 1024
+    return f"{n:.1f}GB"
+
+
+def main(argv: list[str] | None = None) -> None:
+    parser = argparse.ArgumentParser(
+        prog="cuemcp compress",
+        description="Compress large prompt/payload/response text in an existing DB, or report space saved.",
+    )
+    parser.add_argument("--db", required=True, help="SQLite DB path (e.g. a shard or an archive)")
+    parser.add_argument("--stats", action="store_true", help="Only report compression stats")
+    parser.add_argument(
+        "--force",
+        action="store_true",
+        help="Allow rewriting ~/.cue/cue.db, which cue-console and cueme read as plain text",
+    )
+    parser.add_argument(
+        "--min-bytes",
+        type=int,
+        default=None,
+        help="Compress values at least this large (default: CUE_COMPRESSION_MIN_BYTES or 1024)",
+    )
+    args = parser.parse_args(argv)
+
+    db_path = Path(args.db).expanduser()
+    if not db_path.exists():
+        parser.error(f"database not found: {db_path}")
+    if not args.stats and not args.force and db_path.resolve() == DEFAULT_DB_PATH.resolve():
+        parser.error(
+            f"{db_path} is served by cue-console and cueme, which cannot read compressed rows; "
+            "pass --force to compress it anyway"
+        )
+
+    engine = create_engine(f"sqlite:///{db_path}", echo=False)
+    try:
+        if not args.stats:
+            count = compress_existing(engine, min_bytes=args.min_bytes)
+            print(f"[MCP] Compressed {count} values")
+        total_saved = 0
+        for row in compression_stats(engine):
+            total_saved += row["saved_bytes"]
+            print(
+                f"{row['column']:<34} rows={row['rows']:<8} compressed={row['compressed_rows']:<8} "
+                f"stored={_fmt_bytes(row['stored_bytes']):<10} saved={_fmt_bytes(row['saved_bytes'])}"
+            )
+        print(f"[MCP] Total saved: {_fmt_bytes(total_saved)}")
+    finally:
+        engine.dispose()
+
+
+if __name__ == "__main__":
+    main()
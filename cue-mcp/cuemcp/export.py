@@ -0,0 +1,268 @@
+"""History export: stream cue_requests + cue_responses as JSONL/CSV.
+
+Rows are read with keyset pagination on ``cue_requests.id``; every page is
+fetched on its own short-lived connection so a long export never pins a read
+snapshot (and therefore never blocks WAL checkpoints of a live DB).
+"""
+import argparse
+import csv
+import gzip
+import json
+import sys
+from pathlib import Path
+from typing import Any, Iterator, TextIO
+
+from sqlalchemy import create_engine, text
+from sqlalchemy.engine import Engine
+
+from .compression import decompress_text
+
+DEFAULT_DB_PATH = Path.home() / ".cue/cue.db"
+DEFAULT_BATCH_SIZE = 500
+
+EXPORT_COLUMNS = [
+    "id",
+    "request_id",
+    "agent_id",
+    "prompt",
+    "payload",
+    "status",
+    "created_at",
+    "updated_at",
+    "response_id",
+    "response_json",
+    "cancelled",
+    "responded_at",
+    "attachments",
+]
+
+
+def _normalize_ts(value: str | None) -> str | None:
+    # SQLModel writes "YYYY-MM-DD HH:MM:SS", the console writes ISO with "T".
+    if not value:
+        return None
+    return str(value).strip().replace("T", " ")
+
+
+def _fetch_page(
+    engine: Engine,
+    after_id: int,
+    limit: int,
+    agent_ids: list[str],
+    since: str | None,
+    until: str | None,
+) -> list[dict[str, Any]]:
+    where = ["r.id > :after_id"]
+    params: dict[str, Any] = {"after_id": int(after_id), "limit": int(limit)}
+    if agent_ids:
+        keys = [f"a{i}" for i in range(len(agent_ids))]
+        where.append(f"r.agent_id IN ({', '.join(':' + k for k in keys)})")
+        params.update(dict(zip(keys, agent_ids)))
+    if since:
+        where.append("REPLACE(r.created_at, 'T', ' ') >= :since")
+        params["since"] = since
+    if until:
+        where.append("REPLACE(r.created_at, 'T', ' ') < :until")
+        params["until"] = until
+
+    page_sql = text(
+        f"""
+        SELECT r.id, r.request_id, r.agent_id, r.prompt, r.payload, r.status,
+               r.created_at, r.updated_at,
+               resp.id AS response_id, resp.response_json, resp.cancelled,
+               resp.created_at AS responded_at
+        FROM cue_requests r
+        LEFT JOIN cue_responses resp ON resp.request_id = r.request_id
+        WHERE {' AND '.join(where)}
+        ORDER BY r.id ASC
+        LIMIT :limit
+        """
+    )
+
+    # One short connection per page: the read snapshot ends when the block exits.
+    with engine.connect() as conn:
+        rows = [dict(r._mapping) for r in conn.execute(page_sql, params)]
+        response_ids = [int(r["response_id"]) for r in rows if r["response_id"]]
+        files_by_response: dict[int, list[dict[str, Any]]] = {}
+        if response_ids:
+            keys = [f"rid{i}" for i in range(len(response_ids))]
+            files_sql = text(
+                f"""
+                SELECT rf.response_id, f.file, f.mime_type, f.size_bytes, f.sha256
+                FROM cue_response_files rf
+                JOIN cue_files f ON f.id = rf.file_id
+                WHERE rf.response_id IN ({', '.join(':' + k for k in keys)})
+                ORDER BY rf.response_id ASC, rf.idx ASC
+                """
+            )
+            for f in conn.execute(files_sql, dict(zip(keys, response_ids))):
+                files_by_response.setdefault(int(f.response_id), []).append(
+                    {
+                        "file": str(f.file or ""),
+                        "mime_type": str(f.mime_type or ""),
+                        "size_bytes": int(f.size_bytes or 0),
+                        "sha256": str(f.sha256 or ""),
+                    }
+                )
+
+    for r in rows:
+        rid = int(r["response_id"] or 0)
+        for col in ("prompt", "payload", "response_json"):
+            r[col] = decompress_text(r[col])
+        r["cancelled"] = None if r["cancelled"] is None else bool(r["cancelled"])
+        r["attachments"] = files_by_response.get(rid, [])
+    return rows
+
+
+def iter_history(
+    engine: Engine,
+    *,
+    after_id: int = 0,
+    agent_ids: list[str] | None = None,
+    since: str | None = None,
+    until: str | None = None,
+    batch_size: int = DEFAULT_BATCH_SIZE,
+) -> Iterator[list[dict[str, Any]]]:
+    """Yield pages of joined history rows with ``id > after_id``, oldest first."""
+    agent_ids = [a for a in (agent_ids or []) if a]
+    since = _normalize_ts(since)
+    until = _normalize_ts(until)
+    cursor = int(after_id)
+    while True:
+        page = _fetch_page(engine, cursor, batch_size, agent_ids, since, until)
+        if not page:
+            return
+        yield page
+        cursor = int(page[-1]["id"])
+        if len(page) < batch_size:
+            return
+
+
+def _read_checkpoint(path: Path | None) -> int:
+    if path is None or not path.exists():
+        return 0
+    try:
+        return int(path.read_text(encoding="utf-8").strip() or 0)
+    except ValueError:
+        raise RuntimeError(f"Invalid checkpoint file: {path}")
+
+
+def _write_checkpoint(path: Path, last_id: int) -> None:
+    tmp = path.with_name(path.name + ".tmp")
+    tmp.write_text(str(int(last_id)), encoding="utf-8")
+    tmp.replace(path)
+
+
+def _open_output(output: str, *, use_gzip: bool, append: bool) -> TextIO:
+    if output == "-":
+        if use_gzip:
+            return gzip.open(sys.stdout.buffer, "at" if append else "wt", encoding="utf-8", newline="")
+        return sys.stdout
+    mode = "at" if append else "wt"
+    if use_gzip:
+        # Appending to a gzip file adds a new member; readers concatenate them.
+        return gzip.open(output, mode, encoding="utf-8", newline="")
+    return open(output, mode, encoding="utf-8", newline="")
+
+
+def export_history(
+    engine: Engine,
+    out: TextIO,
+    *,
+    fmt: str = "jsonl",
+    after_id: int = 0,
+    agent_ids: list[str] | None = None,
+    since: str | None = None,
+    until: str | None = None,
+    batch_size: int = DEFAULT_BATCH_SIZE,
+    write_header: bool = True,
+    checkpoint: Path | None = None,
+) -> tuple[int, int]:
+    """Write history rows to ``out``. Returns (rows written, last exported id)."""
+    if fmt not in ("jsonl", "csv"):
+        raise ValueError(f"Unsupported format: {fmt}")
+
+    writer = None
+    if fmt == "csv":
+        writer = csv.DictWriter(out, fieldnames=EXPORT_COLUMNS)
+        if write_header:
+            writer.writeheader()
+
+    count = 0
+    last_id = int(after_id)
+    for page in iter_history(
+        engine,
+        after_id=after_id,
+        agent_ids=agent_ids,
+        since=since,
+        until=until,
+        batch_size=batch_size,
+    ):
+        for row in page:
+            if writer is not None:
+                row = dict(row)
+                row["attachments"] = json.dumps(row["attachments"], ensure_ascii=False)
+                writer.writerow(row)
+            else:
+                out.write(json.dumps(row, ensure_ascii=False, default=str))
+                out.write("\n")
+        count += len(page)
+        last_id = int(page[-1]["id"])
+        out.flush()
+        if checkpoint is not None:
+            _write_checkpoint(checkpoint, last_id)
+    return count, last_id
+
+
+def main(argv: list[str] | None = None) -> None:
+    parser = argparse.ArgumentParser(
+        prog="cuemcp export",
+        description="Stream cue history (requests, responses, attachment metadata) as JSONL or CSV.",
+    )
+    parser.add_argument("--db", default=str(DEFAULT_DB_PATH), help="SQLite DB path (default: ~/.cue/cue.db)")
+    parser.add_argument("--format", dest="fmt", choices=["jsonl", "csv"], default="jsonl")
+    parser.add_argument("-o", "--output", default="-", help="Output file, '-' for stdout (default)")
+    parser.add_argument("--agent-id", action="append", default=[], help="Only export this agent (repeatable)")
+    parser.add_argument("--since", help="Only requests created at/after this time (ISO 8601)")
+    parser.add_argument("--until", help="Only requests created before this time (ISO 8601)")
+    parser.add_argument("--gzip", action="store_true", help="gzip the output (implied by a .gz output name)")
+    parser.add_argument("--checkpoint", help="Checkpoint file; resumes after the recorded id and is updated per page")
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE)
+    args = parser.parse_args(argv)
+
+    db_path = Path(args.db).expanduser()
+    if not db_path.exists():
+        parser.error(f"database not found: {db_path}")
+    if args.batch_size <= 0:
+        parser.error("--batch-size must be positive")
+
+    checkpoint = Path(args.checkpoint).expanduser() if args.checkpoint else None
+    after_id = _read_checkpoint(checkpoint)
+    resuming = after_id > 0
+    use_gzip = args.gzip or args.output.endswith(".gz")
+
+    engine = create_engine(f"sqlite:///{db_path}", echo=False)
+    out = _open_output(args.output, use_gzip=use_gzip, append=resuming)
+    try:
+        count, last_id = export_history(
+            engine,
+            out,
+            fmt=args.fmt,
+            after_id=after_id,
+            agent_ids=args.agent_id,
+            since=args.since,
+            until=args.until,
+            batch_size=args.batch_size,
+            write_header=not resuming,
+            checkpoint=checkpoint,
+        )
+    finally:
+        if out is not sys.stdout:
+            out.close()
+        engine.dispose()
+
+    print(f"[MCP] Exported {count} rows (last id: {last_id})", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+"""Attachment storage shared with cue-console (~/.cue/files + cue_files)."""
+import base64
+import hashlib
+from datetime import datetime
+from pathlib import Path
+
+from sqlalchemy import text
+from sqlalchemy.engine import Connection
+
+CUE_DIR = Path.home() / ".cue"
+
+_EXT_BY_MIME = {
+    "image/png": "png",
+    "image/jpeg": "jpg",
+    "image/jpg": "jpg",
+    "image/webp": "webp",
+    "image/gif": "gif",
+}
+
+
+def abs_path_from_file_ref(file_ref: str) -> Path:
+    # file_ref is stored as a rel path like "files/<sha>.<ext>".
+    clean = str(file_ref or "").lstrip("/")
+    return CUE_DIR / clean
+
+
+def _pick_file_ref(conn: Connection, sha256_hex: str, ext: str) -> str:
+    # Same shortest-unique-prefix naming as cue-console's files.ts.
+    for n in (24, 28, 32, 40, 48, 56, 64):
+        rel = f"files/{sha256_hex[:n]}.{ext}"
+        row = conn.execute(
+            text("SELECT sha256 FROM cue_files WHERE file = :f LIMIT 1"), {"f": rel}
+        ).fetchone()
+        if row is None or str(row[0] or "").lower() == sha256_hex:
+            return rel
+    return f"files/{sha256_hex}.{ext}"
+
+
+def upsert_file_from_base64(conn: Connection, mime_type: str, base64_data: str) -> int:
+    """Store decoded bytes under ~/.cue/files and upsert cue_files. Returns the file id."""
+    data = base64.b64decode(str(base64_data or ""))
+    if not data:
+        raise ValueError("empty base64")
+    sha256_hex = hashlib.sha256(data).hexdigest()
+    ext = _EXT_BY_MIME.get((mime_type or "").lower().strip(), "bin")
+    rel = _pick_file_ref(conn, sha256_hex, ext)
+
+    path = abs_path_from_file_ref(rel)
+    if not path.exists():
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(data)
+
+    conn.execute(
+        text(
+            """
+            INSERT INTO cue_files (sha256, file, mime_type, size_bytes, created_at)
+            VALUES (:sha256, :file, :mime_type, :size_bytes, :created_at)
+            ON CONFLICT (sha256) DO UPDATE SET
+                file = excluded.file,
+                mime_type = excluded.mime_type,
+                size_bytes = excluded.size_bytes
+            """
+        ),
+        {
+            "sha256": sha256_hex,
+            "file": rel,
+            "mime_type": mime_type or "application/octet-stream",
+            "size_bytes": len(data),
+            "created_at": datetime.now().astimezone().isoformat(timespec="milliseconds"),
+        },
+    )
+    return int(
+        conn.execute(
+            text("SELECT id FROM cue_files WHERE sha256 = :sha256"), {"sha256": sha256_hex}
+        ).scalar_one()
+    )
+
+
+def ensure_attachment_tables(conn: Connection) -> None:
+    """Create cue-console's attachment tables (same DDL) in a DB the console never opened."""
+    conn.execute(
+        text(
+            """
+            CREATE TABLE IF NOT EXISTS cue_files (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                sha256 TEXT UNIQUE NOT NULL,
+                file TEXT NOT NULL,
+                mime_type TEXT NOT NULL,
+                size_bytes INTEGER NOT NULL,
+                created_at DATETIME NOT NULL
+            )
+            """
+        )
+    )
+    conn.execute(
+        text(
+            """
+            CREATE TABLE IF NOT EXISTS cue_response_files (
+                response_id INTEGER NOT NULL,
+                file_id INTEGER NOT NULL,
+                idx INTEGER NOT NULL,
+                PRIMARY KEY (response_id, idx)
+            )
+            """
+        )
+    )
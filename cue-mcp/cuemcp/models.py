@@ -1,11 +1,13 @@
 """SQLModel data models."""
-import json
 from datetime import datetime
 from enum import Enum
 from typing import Optional
 
 from pydantic import BaseModel
-from sqlmodel import Column, Field, SQLModel, Text
+from sqlmodel import Column, Field, Index, SQLModel, Text
+
+from . import codec
+from .compression import CompressedText
 
 
  # Debug: 联调失败优先查调用是否到达/是否入库，不要先怀疑 status 大小写
@@ -36,17 +38,37 @@ class UserResponse(BaseModel):
         """Parse from JSON string."""
         return cls.model_validate_json(json_str)
 
+    @classmethod
+    def from_trusted_json(cls, json_str: str) -> "UserResponse":
+        """Parse without validation. Only for rows written by cuemcp/cue-console."""
+        data = codec.loads(json_str)
+        if not isinstance(data, dict):
+            return cls.model_construct(text="", images=[])
+        images = [
+            ImageContent.model_construct(**img)
+            for img in (data.get("images") or [])
+            if isinstance(img, dict)
+        ]
+        return cls.model_construct(text=str(data.get("text") or ""), images=images)
+
 
 class CueRequest(SQLModel, table=True):
     """Request from MCP -> client (cue-hub / simulator)."""
     __tablename__ = "cue_requests"
+    __table_args__ = (
+        # Serves the pending queue order: status, then priority/deadline.
+        Index("ix_cue_requests_status_priority_deadline", "status", "priority", "deadline"),
+    )
 
     id: Optional[int] = Field(default=None, primary_key=True)
     request_id: str = Field(unique=True, index=True)
     agent_id: str = Field(default="", index=True)
-    prompt: str  # Message body shown to the user
-    payload: Optional[str] = Field(default=None, sa_column=Column(Text))  # Optional structured payload (JSON string)
+    prompt: str = Field(sa_column=Column(CompressedText, nullable=False))  # Message body shown to the user
+    payload: Optional[str] = Field(default=None, sa_column=Column(CompressedText))  # Optional structured payload (JSON string)
+    rendered_payload: Optional[str] = Field(default=None, sa_column=Column(Text))  # Terminal text of the validated payload
     status: RequestStatus = Field(default=RequestStatus.PENDING)
+    priority: int = Field(default=0, sa_column_kwargs={"server_default": "0"})  # Higher is served first
+    deadline: Optional[datetime] = Field(default=None)  # Expires (CANCELLED) once passed
     created_at: datetime = Field(default_factory=datetime.now)
     updated_at: datetime = Field(default_factory=datetime.now)
 
@@ -57,14 +79,15 @@ class CueResponse(SQLModel, table=True):
 
     id: Optional[int] = Field(default=None, primary_key=True)
     request_id: str = Field(unique=True, index=True, foreign_key="cue_requests.request_id")
-    response_json: str = Field(sa_column=Column(Text))  # JSON-serialized UserResponse
+    response_json: str = Field(sa_column=Column(CompressedText))  # JSON-serialized UserResponse
     cancelled: bool = Field(default=False)
+    group_response_id: Optional[int] = Field(default=None, index=True)  # Set when fanned out from a group reply
     created_at: datetime = Field(default_factory=datetime.now)
 
     @property
     def response(self) -> UserResponse:
         """Return the parsed response."""
-        return UserResponse.from_json(self.response_json)
+        return UserResponse.from_trusted_json(self.response_json)
 
     @classmethod
     def create(cls, request_id: str, response: UserResponse, cancelled: bool = False):
@@ -74,3 +97,37 @@ class CueResponse(SQLModel, table=True):
             response_json=response.to_json(),
             cancelled=cancelled
         )
+
+
+class CueGroupResponse(SQLModel, table=True):
+    """One reply to a group, fanned out to every pending request of its members."""
+    __tablename__ = "cue_group_responses"
+
+    id: Optional[int] = Field(default=None, primary_key=True)
+    group_id: str = Field(index=True)
+    response_json: str = Field(sa_column=Column(CompressedText))  # JSON-serialized UserResponse (shared)
+    cancelled: bool = Field(default=False)
+    created_at: datetime = Field(default_factory=datetime.now)
+
+
+class CueGroupResponseFile(SQLModel, table=True):
+    """Attachments of a group reply, stored once and linked to each fanned-out response."""
+    __tablename__ = "cue_group_response_files"
+
+    group_response_id: int = Field(primary_key=True, foreign_key="cue_group_responses.id")
+    idx: int = Field(primary_key=True)
+    file_id: int
+
+
+class AgentSummary(SQLModel, table=True):
+    """Per-agent inbox state, maintained by triggers on cue_requests/cue_responses."""
+    __tablename__ = "agent_summaries"
+
+    agent_id: str = Field(primary_key=True)
+    last_request_pk: int = Field(default=0)  # cue_requests.id of the latest request
+    last_request_id: str = Field(default="")
+    last_request_at: Optional[str] = Field(default=None)  # Raw text: writers use different timestamp layouts
+    last_status: str = Field(default="")
+    last_response_at: Optional[str] = Field(default=None)
+    pending_count: int = Field(default=0)
+    total_count: int = Field(default=0)
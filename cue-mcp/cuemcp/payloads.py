@@ -0,0 +1,127 @@
+"""Typed cue() payload schemas, validated once when a request is created.
+
+The schemas accept what cue-console's payload card renders (options as
+strings or {id, label}, form fields as strings or objects; numbers and
+booleans are taken as their text, like the console's String(opt)) and ignore
+unknown keys. A valid payload is stored in normalized form together with its terminal
+rendering, so displaying a pending request never re-parses it.
+"""
+from typing import Annotated, Any, Literal, Optional, Union
+
+from pydantic import BaseModel, BeforeValidator, ConfigDict, Discriminator, Field, Tag, TypeAdapter, ValidationError
+
+from . import codec
+from .terminal_render import render_parsed
+
+
+class PayloadError(ValueError):
+    """Payload rejected by cue(); the message is meant for the calling agent."""
+
+
+class _Schema(BaseModel):
+    model_config = ConfigDict(extra="ignore")
+
+
+def _scalar_to_str(value: Any) -> Any:
+    # The console renders options with String(opt): accept numbers and booleans as their text.
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    if isinstance(value, (int, float)):
+        return str(value)
+    return value
+
+
+_Text = Annotated[str, BeforeValidator(_scalar_to_str)]
+
+
+def _str_or_model(model: type[BaseModel]):
+    """A string or an object: objects are validated only as ``model``, so its errors are the ones reported."""
+    return Annotated[
+        Union[Annotated[_Text, Tag("str")], Annotated[model, Tag(model.__name__)]],
+        Discriminator(lambda v: model.__name__ if isinstance(v, (dict, BaseModel)) else "str"),
+    ]
+
+
+class ChoiceOption(_Schema):
+    id: _Text = ""
+    label: _Text = ""
+
+
+Option = _str_or_model(ChoiceOption)
+
+
+class ChoicePayload(_Schema):
+    type: Literal["choice"]
+    options: list[Option] = Field(min_length=1)
+    allow_multiple: bool = False
+
+
+class ConfirmPayload(_Schema):
+    type: Literal["confirm"]
+    variant: Optional[str] = None
+    text: str = ""
+    confirm_label: str = "Confirm"
+    cancel_label: str = "Cancel"
+
+
+class FormField(_Schema):
+    id: _Text = ""
+    label: _Text = ""
+    kind: str = ""
+    options: list[Option] = []
+    allow_multiple: bool = False
+
+
+class FormPayload(_Schema):
+    type: Literal["form"]
+    fields: list[_str_or_model(FormField)] = Field(min_length=1)
+
+
+_PAYLOAD_ADAPTER = TypeAdapter(
+    Annotated[Union[ChoicePayload, ConfirmPayload, FormPayload], Field(discriminator="type")]
+)
+
+_EXAMPLES = (
+    '{"type":"choice","options":["Continue","Stop"]} | '
+    '{"type":"confirm","text":"Continue?"} | '
+    '{"type":"form","fields":[{"label":"Env","options":["prod","staging"]}]}'
+)
+
+
+def _describe(error: ValidationError) -> str:
+    problems: dict[str, str] = {}
+    for err in error.errors(include_url=False):
+        # loc[0] is the discriminator tag; union branch tags ("str", "FormField") are noise.
+        parts = [p for p in err["loc"][1:] if isinstance(p, int) or (p != "str" and p[:1].islower())]
+        loc = ".".join(str(p) for p in parts) or "payload"
+        problems.setdefault(loc, err["msg"])
+    return "; ".join(f"{loc}: {msg}" for loc, msg in problems.items())
+
+
+def normalize_payload(payload: str | None) -> tuple[str | None, str | None]:
+    """Validate a cue() payload. Returns (normalized JSON, rendered terminal text).
+
+    Raises PayloadError with an agent-facing explanation when the payload is invalid.
+    """
+    if payload is None or not payload.strip():
+        return None, None
+    try:
+        data = codec.loads(payload)
+    except ValueError as e:
+        raise PayloadError(f"payload is not valid JSON ({e}). Expected e.g. {_EXAMPLES}") from None
+    if not isinstance(data, dict):
+        raise PayloadError(f"payload must be a JSON object. Expected e.g. {_EXAMPLES}")
+    if data.get("type") not in ("choice", "confirm", "form"):
+        raise PayloadError(
+            f'payload "type" must be "choice", "confirm" or "form" (got {data.get("type")!r}). '
+            f"Expected e.g. {_EXAMPLES}"
+        )
+    try:
+        model = _PAYLOAD_ADAPTER.validate_python(data)
+    except ValidationError as e:
+        raise PayloadError(f"invalid {data['type']} payload: {_describe(e)}. Expected e.g. {_EXAMPLES}") from None
+
+    normalized = model.model_dump(mode="json", exclude_none=True)
+    return codec.dumps(normalized), render_parsed(normalized)
@@ -0,0 +1,255 @@
+"""Optional per-project sharding of the cue mailbox.
+
+SQLite serializes writers per file, so with ``CUE_SHARDING=1`` each agent's
+requests go to a per-project DB under ``~/.cue/shards/`` instead of the shared
+``~/.cue/cue.db``. The project comes from ``CUE_PROJECT_DIR`` (set it in the MCP
+server config) or from the ``agent_envs.project_dir`` the console/cueme
+recorded. Agents without a known project stay on the main DB.
+
+``~/.cue/index.db`` records which shard each agent lives on and keeps a
+contentless trigram index of shard prompts, so recall() does not open every
+shard. cue-console only reads the main DB: it does not show sharded agents.
+cuemcp still serves its message queue and group replies for them. For the
+same reason, ``CUE_COMPRESSION=1`` applies to shards only.
+"""
+import hashlib
+import os
+import re
+from datetime import datetime
+from pathlib import Path
+
+from sqlalchemy import create_engine, text
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import OperationalError
+from sqlmodel import SQLModel
+
+from .compression import compression_enabled, enable_compression
+from .files import CUE_DIR, ensure_attachment_tables
+from .store import ensure_request_schema, immediate_transaction
+from .summary import ensure_agent_summaries
+
+SHARD_DIR = CUE_DIR / "shards"
+INDEX_DB_PATH = CUE_DIR / "index.db"
+
+MAIN_SHARD = ""  # Shard key of the main ~/.cue/cue.db
+
+
+def sharding_enabled() -> bool:
+    return os.environ.get("CUE_SHARDING", "").strip().lower() in ("1", "true", "yes", "on")
+
+
+def shard_key_for_project(project_dir: str) -> str:
+    """Stable, readable shard key: "<basename>-<hash of the full path>"."""
+    path = str(Path(project_dir).expanduser().resolve())
+    slug = re.sub(r"[^A-Za-z0-9_.]+", "-", Path(path).name).strip("-.")[:32] or "project"
+    digest = hashlib.sha1(path.encode("utf-8")).hexdigest()[:10]
+    return f"{slug}-{digest}"
+
+
+class ShardRouter:
+    """Route agents to DB engines; a pass-through to the main engine when sharding is off."""
+
+    def __init__(self, main_engine: Engine, *, enabled: bool | None = None, project_dir: str | None = None):
+        self.main_engine = main_engine
+        self.enabled = sharding_enabled() if enabled is None else enabled
+        self.project_dir = project_dir if project_dir is not None else os.environ.get("CUE_PROJECT_DIR") or None
+        self._index: Engine | None = None
+        self._recall_index = False
+        self._engines: dict[str, Engine] = {}
+        self._agent_shards: dict[str, str] = {}
+
+    def _index_engine(self) -> Engine:
+        if self._index is None:
+            INDEX_DB_PATH.parent.mkdir(parents=True, exist_ok=True)
+            self._index = create_engine(f"sqlite:///{INDEX_DB_PATH}", echo=False)
+            with self._index.begin() as conn:
+                conn.execute(
+                    text(
+                        "CREATE TABLE IF NOT EXISTS shards ("
+                        "shard_key TEXT PRIMARY KEY, project_dir TEXT NOT NULL, created_at TEXT NOT NULL)"
+                    )
+                )
+                conn.execute(
+                    text(
+                        "CREATE TABLE IF NOT EXISTS agent_shards ("
+                        "agent_id TEXT PRIMARY KEY, shard_key TEXT NOT NULL, updated_at TEXT NOT NULL)"
+                    )
+                )
+                # AUTOINCREMENT: ids are never reused, so the contentless index never points at a new row.
+                conn.execute(
+                    text(
+                        "CREATE TABLE IF NOT EXISTS recall_entries ("
+                        "id INTEGER PRIMARY KEY AUTOINCREMENT, agent_id TEXT NOT NULL, created_at TEXT NOT NULL)"
+                    )
+                )
+            try:
+                with self._index.begin() as conn:
+                    conn.execute(
+                        text(
+                            "CREATE VIRTUAL TABLE IF NOT EXISTS recall_fts "
+                            "USING fts5(prompt, content='', tokenize='trigram')"
+                        )
+                    )
+                self._recall_index = True
+            except OperationalError:
+                self._recall_index = False  # SQLite without FTS5 trigram: recall() scans shards
+        return self._index
+
+    def _shard_engine(self, shard_key: str) -> Engine:
+        if shard_key == MAIN_SHARD:
+            return self.main_engine
+        shard_engine = self._engines.get(shard_key)
+        if shard_engine is None:
+            SHARD_DIR.mkdir(parents=True, exist_ok=True)
+            shard_engine = create_engine(f"sqlite:///{SHARD_DIR / (shard_key + '.db')}", echo=False)
+            with immediate_transaction(shard_engine) as conn:
+                SQLModel.metadata.create_all(conn)
+            ensure_request_schema(shard_engine)
+            ensure_agent_summaries(shard_engine)
+            with shard_engine.begin() as conn:
+                ensure_attachment_tables(conn)
+            if compression_enabled():
+                # Shards are not read by cue-console, so they may hold compressed rows.
+                enable_compression(shard_engine)
+            self._engines[shard_key] = shard_engine
+        return shard_engine
+
+    def _project_dir_for_agent(self, agent_id: str) -> str | None:
+        if self.project_dir:
+            return self.project_dir
+        try:
+            with self.main_engine.connect() as conn:
+                row = conn.execute(
+                    text("SELECT project_dir FROM agent_envs WHERE agent_id = :agent_id"),
+                    {"agent_id": agent_id},
+                ).fetchone()
+        except OperationalError:
+            # agent_envs is created by cue-console / cueme
+            return None
+        return str(row[0]) if row and row[0] else None
+
+    def _resolve_shard_key(self, agent_id: str) -> str:
+        index = self._index_engine()
+        with index.connect() as conn:
+            row = conn.execute(
+                text("SELECT shard_key FROM agent_shards WHERE agent_id = :agent_id"),
+                {"agent_id": agent_id},
+            ).fetchone()
+        if row is not None:
+            return str(row[0])
+
+        project_dir = self._project_dir_for_agent(agent_id)
+        if not project_dir:
+            return MAIN_SHARD
+
+        shard_key = shard_key_for_project(project_dir)
+        now = datetime.now().isoformat(sep=" ")
+        with index.begin() as conn:
+            conn.execute(
+                text(
+                    "INSERT INTO shards (shard_key, project_dir, created_at) VALUES (:k, :p, :now) "
+                    "ON CONFLICT (shard_key) DO NOTHING"
+                ),
+                {"k": shard_key, "p": project_dir, "now": now},
+            )
+            conn.execute(
+                text(
+                    "INSERT INTO agent_shards (agent_id, shard_key, updated_at) VALUES (:a, :k, :now) "
+                    "ON CONFLICT (agent_id) DO NOTHING"
+                ),
+                {"a": agent_id, "k": shard_key, "now": now},
+            )
+        return shard_key
+
+    def engine_for_agent(self, agent_id: str) -> Engine:
+        """The engine holding this agent's requests."""
+        if not self.enabled or not agent_id:
+            return self.main_engine
+        shard_key = self._agent_shards.get(agent_id)
+        if shard_key is None:
+            shard_key = self._resolve_shard_key(agent_id)
+            self._agent_shards[agent_id] = shard_key
+        return self._shard_engine(shard_key)
+
+    def recorded_engine_for_agent(self, agent_id: str) -> Engine | None:
+        """Lookup only: the shard index.db already records for this agent, else None.
+
+        Unlike engine_for_agent it never falls back to CUE_PROJECT_DIR or
+        agent_envs, and never writes index.db or creates a shard DB, so
+        tools acting on other agents (broadcast) cannot pin them to a shard.
+        """
+        if not self.enabled or not agent_id:
+            return None
+        shard_key = self._agent_shards.get(agent_id)
+        if shard_key is None:
+            if not INDEX_DB_PATH.exists():
+                return None
+            index = create_engine(f"sqlite:///file:{INDEX_DB_PATH}?mode=ro&uri=true", echo=False)
+            try:
+                with index.connect() as conn:
+                    row = conn.execute(
+                        text("SELECT shard_key FROM agent_shards WHERE agent_id = :agent_id"),
+                        {"agent_id": agent_id},
+                    ).fetchone()
+            except OperationalError:
+                return None
+            finally:
+                index.dispose()
+            if row is None:
+                return None
+            shard_key = str(row[0])
+        if shard_key == MAIN_SHARD:
+            return self.main_engine
+        if shard_key not in self._engines and not (SHARD_DIR / (shard_key + ".db")).exists():
+            return None
+        return self._shard_engine(shard_key)
+
+    def is_sharded(self, agent_id: str) -> bool:
+        return self.engine_for_agent(agent_id) is not self.main_engine
+
+    def record_prompt(self, agent_id: str, prompt: str) -> None:
+        """Index a sharded agent's prompt for recall(). Best effort: the request is already stored."""
+        if not self.enabled or not self.is_sharded(agent_id) or not self._recall_index:
+            return
+        try:
+            with self._index_engine().begin() as conn:
+                entry_id = conn.execute(
+                    text("INSERT INTO recall_entries (agent_id, created_at) VALUES (:a, :now)"),
+                    {"a": agent_id, "now": datetime.now().isoformat(sep=" ")},
+                ).lastrowid
+                conn.execute(
+                    text("INSERT INTO recall_fts (rowid, prompt) VALUES (:rowid, :prompt)"),
+                    {"rowid": entry_id, "prompt": prompt},
+                )
+        except OperationalError as e:
+            print(f"[MCP] Could not index prompt of {agent_id} for recall: {e}")
+
+    def can_search_recall_index(self, hints: str) -> bool:
+        if not self.enabled or len(hints) < 3:  # Trigram matching needs 3+ characters
+            return False
+        self._index_engine()
+        return self._recall_index
+
+    def search_recall_index(self, hints: str) -> tuple[str, datetime] | None:
+        """(agent_id, created_at) of the newest sharded prompt containing ``hints``."""
+        with self._index_engine().connect() as conn:
+            row = conn.execute(
+                text(
+                    "SELECT e.agent_id, e.created_at FROM recall_fts f "
+                    "JOIN recall_entries e ON e.id = f.rowid "
+                    "WHERE recall_fts MATCH :q ORDER BY e.id DESC LIMIT 1"
+                ),
+                {"q": '"' + hints.replace('"', '""') + '"'},
+            ).fetchone()
+        return (str(row[0]), datetime.fromisoformat(str(row[1]))) if row else None
+
+    def shard_engines(self) -> list[Engine]:
+        return self.all_engines()[1:]
+
+    def all_engines(self) -> list[Engine]:
+        """Main engine first, then every shard known to the index."""
+        if not self.enabled:
+            return [self.main_engine]
+        with self._index_engine().connect() as conn:
+            keys = [str(r[0]) for r in conn.execute(text("SELECT shard_key FROM shards ORDER BY shard_key"))]
+        return [self.main_engine] + [self._shard_engine(k) for k in keys]
@@ -7,16 +7,32 @@ import asyncio
 import uuid
 import base64
 from pathlib import Path
-from datetime import datetime
+from datetime import datetime, timedelta
 
 from fastmcp import FastMCP
 from fastmcp.server.middleware import Middleware, MiddlewareContext
 from mcp.types import TextContent, ImageContent
 from sqlalchemy import text
+from sqlalchemy.engine import Engine
 from sqlmodel import Session, create_engine, select, SQLModel
 
+from .compression import search_prompt_index
+from .files import abs_path_from_file_ref
 from .models import CueRequest, CueResponse, RequestStatus, UserResponse
 from .naming import generate_name
+from .payloads import PayloadError, normalize_payload
+from .routing import ShardRouter
+from .store import (
+    answer_from_queued_message,
+    cancel_request,
+    claim_queued_message,
+    create_request,
+    ensure_request_schema,
+    immediate_transaction,
+    release_queued_message,
+    set_request_status,
+)
+from .summary import ensure_agent_summaries
 
 # Configuration
 DB_PATH = Path.home() / ".cue/cue.db"
@@ -29,9 +45,10 @@ CUE_TODO_CONSTRAINT_TEXT = (
 )
 
 
-# Create engine
+# Create engine (tables are created under the write lock: agents start their servers concurrently)
 engine = create_engine(DATABASE_URL, echo=False)
-SQLModel.metadata.create_all(engine)
+with immediate_transaction(engine) as _conn:
+    SQLModel.metadata.create_all(_conn)
 
 
 def _ensure_schema_v3_or_guide_migrate() -> None:
@@ -68,15 +85,20 @@ def _ensure_schema_v3_or_guide_migrate() -> None:
 
 
 _ensure_schema_v3_or_guide_migrate()
+ensure_request_schema(engine)
+ensure_agent_summaries(engine)
+
+# Per-project shards when CUE_SHARDING=1; otherwise everything uses `engine`
+router = ShardRouter(engine)
+if router.enabled:
+    print(
+        "[MCP] Sharding on: agents with a known project use ~/.cue/shards/*.db. "
+        "cue-console only reads the main DB and will not show them; "
+        "its queued messages and group broadcasts still reach them through cuemcp."
+    )
 
 
-def _abs_path_from_file_ref(file_ref: str) -> Path:
-    # file_ref is stored as a rel path like "files/<sha>.<ext>".
-    clean = str(file_ref or "").lstrip("/")
-    return Path.home() / ".cue" / clean
-
-
-def _fetch_files_for_response_id(response_id: int) -> list[dict]:
+def _fetch_files_for_response_id(response_id: int, db_engine: Engine | None = None) -> list[dict]:
     if not response_id:
         return []
     sql = text(
@@ -88,8 +110,8 @@ def _fetch_files_for_response_id(response_id: int) -> list[dict]:
         ORDER BY rf.idx ASC
         """
     )
-    with Session(engine) as session:
-        rows = session.exec(sql, {"rid": int(response_id)}).all()
+    with Session(db_engine or engine) as session:
+        rows = session.exec(sql, params={"rid": int(response_id)}).all()
     out: list[dict] = []
     for r in rows:
         # SQLAlchemy row can be tuple-like
@@ -98,6 +120,75 @@ def _fetch_files_for_response_id(response_id: int) -> list[dict]:
         out.append({"file": str(file_ref or ""), "mime_type": str(mime or "")})
     return out
 
+
+def _fetch_files_for_group_response_id(group_response_id: int, db_engine: Engine) -> list[dict]:
+    # Group replies store their attachments once, in cue_group_response_files.
+    sql = text(
+        """
+        SELECT f.file as file, f.mime_type as mime_type
+        FROM cue_group_response_files gf
+        JOIN cue_files f ON f.id = gf.file_id
+        WHERE gf.group_response_id = :gid
+        ORDER BY gf.idx ASC
+        """
+    )
+    with Session(db_engine) as session:
+        rows = session.exec(sql, params={"gid": int(group_response_id)}).all()
+    return [{"file": str(r[0] or ""), "mime_type": str(r[1] or "")} for r in rows]
+
+
+def _fetch_files_for_response(db_response: CueResponse, db_engine: Engine | None = None) -> list[dict]:
+    db_engine = db_engine or engine
+    if db_response.group_response_id:
+        return _fetch_files_for_group_response_id(int(db_response.group_response_id), db_engine)
+    return _fetch_files_for_response_id(int(db_response.id or 0), db_engine)
+
+
+def _encode_image_file(file_ref: str, mime: str) -> ImageContent | None:
+    p = abs_path_from_file_ref(file_ref)
+    if not p.exists() or not p.is_file():
+        return None
+    try:
+        data = p.read_bytes()
+    except Exception:
+        return None
+    b64 = base64.b64encode(data).decode("utf-8")
+    return ImageContent(type="image", data=b64, mimeType=mime or "image/png")
+
+
+def _parse_deadline(deadline: float | str | None) -> datetime | None:
+    """Parse a deadline: seconds from now (e.g. 300 or "300") or an ISO 8601 timestamp."""
+    if deadline is None or not str(deadline).strip():
+        return None
+    if isinstance(deadline, (int, float)):
+        try:
+            return datetime.now() + timedelta(seconds=float(deadline))
+        except (ValueError, OverflowError):
+            raise ValueError(f"Invalid deadline: {deadline!r} (use seconds from now or an ISO 8601 timestamp)")
+    raw = str(deadline).strip()
+    try:
+        return datetime.now() + timedelta(seconds=float(raw))
+    except (ValueError, OverflowError):
+        pass
+    try:
+        parsed = datetime.fromisoformat(raw.replace("Z", "+00:00"))
+    except ValueError:
+        raise ValueError(f"Invalid deadline: {raw!r} (use seconds from now or an ISO 8601 timestamp)")
+    if parsed.tzinfo is not None:
+        # Stored timestamps are naive local time.
+        parsed = parsed.astimezone().replace(tzinfo=None)
+    return parsed
+
+
+def _timeout_until(deadline_at: datetime | None, timeout: float | None) -> tuple[float | None, bool]:
+    """Cap a wait timeout at the deadline. Returns (timeout, capped_by_deadline)."""
+    if deadline_at is None:
+        return timeout, False
+    remaining = max(0.0, (deadline_at - datetime.now()).total_seconds())
+    if timeout is None or remaining < timeout:
+        return remaining, True
+    return timeout, False
+
 # Create FastMCP server
 mcp = FastMCP("cue")
 
@@ -146,39 +237,61 @@ async def recall(hints: str) -> str:
     Returns:
         A short message for you (includes agent_id).
     """
-    with Session(engine) as session:
-        # Search records where prompt contains the hints
-        results = session.exec(
-            select(CueRequest)
-            .where(CueRequest.agent_id != "")
-            .where(CueRequest.prompt.contains(hints))
-            .order_by(CueRequest.created_at.desc())
-        ).all()
-        
-        if results:
-            agent_id = results[0].agent_id
-            print(f"[MCP] Recovered agent_id: {agent_id}")
-            return (
-                f"agent_id={agent_id}\n\n"
-                "Use this agent_id when calling cue(prompt, agent_id)."
-            )
-
-        # If not found, generate a new one
-        agent_id = generate_name()
-        print(f"[MCP] No match found; generated new agent_id: {agent_id}")
+    # Search records where prompt contains the hints (newest match across shards).
+    # Sharded prompts are found through the index DB instead of opening every shard.
+    use_index = router.can_search_recall_index(hints)
+    best: tuple[str, datetime] | None = None
+    for db_engine in [engine] if use_index else router.all_engines():
+        # Only the two columns needed, so compressed prompts/payloads are not decoded.
+        matched = select(CueRequest.agent_id, CueRequest.created_at)
+        with Session(db_engine) as session:
+            found = session.exec(
+                matched.where(CueRequest.agent_id != "")
+                .where(CueRequest.prompt.contains(hints))
+                .order_by(CueRequest.created_at.desc())
+                .limit(1)
+            ).first()
+            # Compressed prompts are only searchable through the prompt index.
+            indexed_id = search_prompt_index(db_engine, hints)
+            if indexed_id is not None:
+                indexed = session.exec(matched.where(CueRequest.id == indexed_id)).first()
+                if indexed and (found is None or indexed.created_at > found.created_at):
+                    found = indexed
+        if found and (best is None or found.created_at > best[1]):
+            best = (found.agent_id, found.created_at)
+    if use_index:
+        hit = router.search_recall_index(hints)
+        if hit and (best is None or hit[1] > best[1]):
+            best = hit
+
+    if best:
+        agent_id = best[0]
+        print(f"[MCP] Recovered agent_id: {agent_id}")
         return (
-            "No matching record found; generated a new agent_id.\n\n"
             f"agent_id={agent_id}\n\n"
             "Use this agent_id when calling cue(prompt, agent_id)."
         )
 
+    # If not found, generate a new one
+    agent_id = generate_name()
+    print(f"[MCP] No match found; generated new agent_id: {agent_id}")
+    return (
+        "No matching record found; generated a new agent_id.\n\n"
+        f"agent_id={agent_id}\n\n"
+        "Use this agent_id when calling cue(prompt, agent_id)."
+    )
+
 
-async def wait_for_response(request_id: str, timeout: float = 600.0) -> CueResponse:
-    """Poll the database and wait for a response."""
+async def wait_for_response(
+    request_id: str,
+    timeout: float | None = 600.0,
+    db_engine: Engine | None = None,
+) -> CueResponse:
+    """Poll the database holding the request and wait for a response."""
     start_time = asyncio.get_event_loop().time()
 
     while True:
-        with Session(engine) as session:
+        with Session(db_engine or engine) as session:
             response = session.exec(
                 select(CueResponse).where(CueResponse.request_id == request_id)
             ).first()
@@ -216,15 +329,9 @@ def _build_tool_result_from_user_response(user_response: UserResponse, files: li
             continue
 
         if mime.lower().startswith("image/"):
-            p = _abs_path_from_file_ref(file_ref)
-            if not p.exists() or not p.is_file():
-                continue
-            try:
-                data = p.read_bytes()
-            except Exception:
-                continue
-            b64 = base64.b64encode(data).decode("utf-8")
-            result.append(ImageContent(type="image", data=b64, mimeType=mime or "image/png"))
+            image = _encode_image_file(file_ref, mime)
+            if image is not None:
+                result.append(image)
         else:
             other_files.append(file_ref)
 
@@ -236,11 +343,22 @@ def _build_tool_result_from_user_response(user_response: UserResponse, files: li
     return result
 
 
+_PAUSE_PAYLOAD = normalize_payload(
+    '{"type":"confirm","variant":"pause","text":"Paused. Click Continue when you are ready.","confirm_label":"Continue","cancel_label":""}'
+)
+
+
 @mcp.tool()
-async def pause(agent_id: str, prompt: str | None = None) -> list[TextContent]:
+async def pause(
+    agent_id: str,
+    prompt: str | None = None,
+    priority: int = 0,
+    deadline: float | str | None = None,
+) -> list[TextContent]:
     """Pause the agent indefinitely until the user clicks Continue in the console.
 
     This tool sends a single-action *confirm* payload (no cancel button) to cue-console.
+    With a deadline, the pause expires once it passes. See cue() for priority/deadline.
 
     Payload JSON format:
         {
@@ -252,22 +370,31 @@ async def pause(agent_id: str, prompt: str | None = None) -> list[TextContent]:
         }
     """
     pause_prompt = prompt or "Waiting for your confirmation. Click Continue when you are ready."
-    payload = '{"type":"confirm","variant":"pause","text":"Paused. Click Continue when you are ready.","confirm_label":"Continue","cancel_label":""}'
+    payload, rendered_payload = _PAUSE_PAYLOAD
 
+    try:
+        deadline_at = _parse_deadline(deadline)
+    except ValueError as e:
+        return [TextContent(type="text", text=f"Error: {str(e)}")]
+    db_engine = router.engine_for_agent(agent_id)
     request_id = f"req_{uuid.uuid4().hex[:12]}"
-    request = CueRequest(
-        request_id=request_id,
-        agent_id=agent_id,
-        prompt=pause_prompt,
-        payload=payload,
-    )
-
-    with Session(engine) as session:
-        session.add(request)
-        session.commit()
+    create_request(db_engine, request_id, agent_id, pause_prompt, payload, priority, deadline_at, rendered_payload)
+    router.record_prompt(agent_id, pause_prompt)
 
-
-    db_response = await wait_for_response(request_id, timeout=None)
+    timeout, _ = _timeout_until(deadline_at, None)
+    try:
+        db_response = await wait_for_response(request_id, timeout=timeout, db_engine=db_engine)
+    except TimeoutError:
+        cancel_request(db_engine, request_id)
+        return [
+            TextContent(
+                type="text",
+                text=(
+                    "The pause deadline passed without the user continuing.\n\n"
+                    + CUE_TODO_CONSTRAINT_TEXT
+                ),
+            )
+        ]
     if db_response.cancelled:
         return [
             TextContent(
@@ -280,7 +407,7 @@ async def pause(agent_id: str, prompt: str | None = None) -> list[TextContent]:
         ]
 
     user_response = db_response.response
-    files = _fetch_files_for_response_id(int(db_response.id or 0))
+    files = _fetch_files_for_response(db_response, db_engine)
     if not user_response.text.strip() and not files:
         return [
             TextContent(
@@ -295,7 +422,13 @@ async def pause(agent_id: str, prompt: str | None = None) -> list[TextContent]:
 
 
 @mcp.tool()
-async def cue(prompt: str, agent_id: str, payload: str | None = None) -> list[TextContent | ImageContent]:
+async def cue(
+    prompt: str,
+    agent_id: str,
+    payload: str | None = None,
+    priority: int = 0,
+    deadline: float | str | None = None,
+) -> list[TextContent | ImageContent]:
     """
     Send the user a cue.
 
@@ -315,6 +448,7 @@ async def cue(prompt: str, agent_id: str, payload: str | None = None) -> list[Te
 
             Notes:
             - `payload` must be a JSON string.
+            - An invalid payload is rejected (nothing is sent to the user) with an error saying what to fix.
             - For form fields, if `options` is present the UI renders them as clickable buttons.
             - The UI should also provide an "Other" action per field to insert "<field>:" for free input.
 
@@ -322,54 +456,61 @@ async def cue(prompt: str, agent_id: str, payload: str | None = None) -> list[Te
             - choice: {"type":"choice","options":["Continue","Stop"]}
             - confirm: {"type":"confirm","text":"Continue?"}
             - form: {"type":"form","fields":[{"label":"Env","options":["prod","staging"]}]}
+        priority: Optional urgency. Higher values are served first (default 0). Use a positive value for
+            blocking questions (e.g. approving a deploy) and leave FYI progress reports at 0.
+        deadline: Optional expiry, either seconds from now (e.g. 300) or an ISO 8601 timestamp. Requests
+            with an earlier deadline are served first; once it passes the request expires without waiting
+            out the full timeout.
     """
     try:
+        # Reject malformed payloads before anything is stored
+        try:
+            payload, rendered_payload = normalize_payload(payload)
+        except PayloadError as e:
+            print(f"[MCP] Rejected payload from {agent_id}: {e}")
+            return [TextContent(type="text", text=f"Invalid payload: {e}\n\nFix the payload and call cue() again.")]
+
         # Create request
+        deadline_at = _parse_deadline(deadline)
+        db_engine = router.engine_for_agent(agent_id)
         request_id = f"req_{uuid.uuid4().hex[:12]}"
-        request = CueRequest(
-            request_id=request_id,
-            agent_id=agent_id,
-            prompt=prompt,
-            payload=payload,
-        )
 
-        with Session(engine) as session:
-            session.add(request)
-            session.commit()
+        # A message the human queued ahead of time answers the request right away.
+        # The console's queue lives in the main DB, even for sharded agents. Claim it
+        # before the request exists, so the console's queue worker cannot take it for the new row.
+        queued = claim_queued_message(engine, agent_id)
+        try:
+            create_request(db_engine, request_id, agent_id, prompt, payload, priority, deadline_at, rendered_payload)
+        except Exception:
+            if queued is not None:
+                release_queued_message(engine, queued[0])
+            raise
+        router.record_prompt(agent_id, prompt)
 
         print(f"[MCP] Request created: {request_id}")
 
-        # Wait for response
+        if queued is not None:
+            try:
+                if answer_from_queued_message(db_engine, request_id, *queued, queue_engine=engine):
+                    print(f"[MCP] Answered from queued message: {queued[0]}")
+                else:
+                    print(f"[MCP] Request already answered; released queued message: {queued[0]}")
+            except Exception as e:
+                print(f"[MCP] Failed to answer from queued message {queued[0]}: {e}")
+
+        # Wait for response (no longer than the deadline, if any)
+        timeout, by_deadline = _timeout_until(deadline_at, 600.0)
         try:
-            db_response = await wait_for_response(request_id)
+            db_response = await wait_for_response(request_id, timeout=timeout, db_engine=db_engine)
         except (asyncio.CancelledError, TimeoutError) as e:
-            with Session(engine) as session:
-                existing_response = session.exec(
-                    select(CueResponse).where(CueResponse.request_id == request_id)
-                ).first()
-                if not existing_response:
-                    response = CueResponse.create(
-                        request_id=request_id,
-                        response=UserResponse(text=""),
-                        cancelled=True,
-                    )
-                    session.add(response)
-
-                db_request = session.exec(
-                    select(CueRequest).where(CueRequest.request_id == request_id)
-                ).first()
-                if db_request:
-                    db_request.status = RequestStatus.CANCELLED
-                    db_request.updated_at = datetime.now()
-                    session.add(db_request)
-
-                session.commit()
-
-            msg = (
-                "Timed out waiting for user response. You MUST NOT continue or add any extra output. Immediately call pause(agent_id) and stop output until resumed.\n\n"
-                if isinstance(e, TimeoutError)
-                else "Tool call was cancelled. Call pause(agent_id) to suspend and wait for resume.\n\n"
-            )
+            cancel_request(db_engine, request_id)
+
+            if isinstance(e, TimeoutError) and by_deadline:
+                msg = "Deadline passed without user response. You MUST NOT continue or add any extra output. Immediately call pause(agent_id) and stop output until resumed.\n\n"
+            elif isinstance(e, TimeoutError):
+                msg = "Timed out waiting for user response. You MUST NOT continue or add any extra output. Immediately call pause(agent_id) and stop output until resumed.\n\n"
+            else:
+                msg = "Tool call was cancelled. Call pause(agent_id) to suspend and wait for resume.\n\n"
             return [TextContent(type="text", text=msg)]
 
         if db_response.cancelled:
@@ -382,18 +523,10 @@ async def cue(prompt: str, agent_id: str, payload: str | None = None) -> list[Te
 
         # Parse response
         user_response = db_response.response
-        files = _fetch_files_for_response_id(int(db_response.id or 0))
+        files = _fetch_files_for_response(db_response, db_engine)
 
         if not user_response.text.strip() and not files:
-            with Session(engine) as session:
-                db_request = session.exec(
-                    select(CueRequest).where(CueRequest.request_id == request_id)
-                ).first()
-                if db_request:
-                    db_request.status = RequestStatus.COMPLETED
-                    db_request.updated_at = datetime.now()
-                    session.add(db_request)
-                    session.commit()
+            set_request_status(db_engine, request_id, RequestStatus.COMPLETED)
             return [
                 TextContent(
                     type="text",
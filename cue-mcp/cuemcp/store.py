@@ -0,0 +1,584 @@
+"""Statement-level request lifecycle (create / complete / cancel).
+
+Each operation is a fixed SQL statement executed in one short transaction,
+instead of an ORM load/modify/save round trip. Keeping the write lock short
+matters because cue-console writes to the same SQLite file.
+"""
+import os
+import time
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from typing import Iterator
+
+from sqlalchemy import bindparam, text
+from sqlalchemy.engine import Connection, Engine
+from sqlalchemy.exc import OperationalError
+from sqlmodel import select
+
+from . import codec
+from .compression import compress_for, has_prompt_index, index_prompt
+from .files import upsert_file_from_base64
+from .models import CueRequest, RequestStatus, UserResponse
+
+QUEUE_WORKER_ID = f"cuemcp:{os.getpid()}"
+QUEUE_LOCK_TTL = timedelta(seconds=60)
+QUEUE_SETTLE_ATTEMPTS = 3
+
+_INSERT_REQUEST = text(
+    """
+    INSERT INTO cue_requests
+        (request_id, agent_id, prompt, payload, rendered_payload, status, priority, deadline,
+         created_at, updated_at)
+    VALUES (:request_id, :agent_id, :prompt, :payload, :rendered_payload, :status, :priority, :deadline,
+            :now, :now)
+    """
+)
+
+_INSERT_RESPONSE = text(
+    """
+    INSERT INTO cue_responses (request_id, response_json, cancelled, created_at)
+    VALUES (:request_id, :response_json, :cancelled, :now)
+    ON CONFLICT (request_id) DO NOTHING
+    """
+)
+
+_UPDATE_STATUS = text(
+    """
+    UPDATE cue_requests SET status = :status, updated_at = :now
+    WHERE request_id = :request_id
+    """
+)
+
+_EXPIRE_OVERDUE_RESPONSES = text(
+    """
+    INSERT INTO cue_responses (request_id, response_json, cancelled, created_at)
+    SELECT request_id, :response_json, 1, :now
+    FROM cue_requests
+    WHERE status = 'PENDING' AND deadline IS NOT NULL AND deadline <= :now
+    ON CONFLICT (request_id) DO NOTHING
+    """
+)
+
+_EXPIRE_OVERDUE_REQUESTS = text(
+    """
+    UPDATE cue_requests SET status = 'CANCELLED', updated_at = :now
+    WHERE status = 'PENDING' AND deadline IS NOT NULL AND deadline <= :now
+    """
+)
+
+_EMPTY_RESPONSE_JSON = UserResponse(text="").to_json()
+
+
+def _fmt_ts(value: datetime) -> str:
+    # Same text layout SQLModel/SQLAlchemy use for DateTime columns on SQLite.
+    return value.strftime("%Y-%m-%d %H:%M:%S.%f")
+
+
+def _now() -> str:
+    return _fmt_ts(datetime.now())
+
+
+@contextmanager
+def immediate_transaction(engine: Engine) -> Iterator[Connection]:
+    """A transaction that takes the SQLite write lock up front (BEGIN IMMEDIATE).
+
+    For check-then-write sequences such as schema upgrades: every agent starts
+    its own cuemcp, and a deferred transaction would let two of them see the
+    same missing column and both try to add it.
+    """
+    with engine.connect() as conn:
+        conn.exec_driver_sql("BEGIN IMMEDIATE")
+        try:
+            yield conn
+        except BaseException:
+            conn.rollback()
+            raise
+        conn.commit()
+
+
+def ensure_request_schema(engine: Engine) -> None:
+    """Add columns/indexes newer than the table on disk (create_all never alters)."""
+    with immediate_transaction(engine) as conn:
+        cols = {row[1] for row in conn.execute(text("PRAGMA table_info(cue_requests)"))}
+        if "priority" not in cols:
+            conn.execute(text("ALTER TABLE cue_requests ADD COLUMN priority INTEGER NOT NULL DEFAULT 0"))
+        if "deadline" not in cols:
+            conn.execute(text("ALTER TABLE cue_requests ADD COLUMN deadline DATETIME"))
+        if "rendered_payload" not in cols:
+            conn.execute(text("ALTER TABLE cue_requests ADD COLUMN rendered_payload TEXT"))
+        conn.execute(
+            text(
+                "CREATE INDEX IF NOT EXISTS ix_cue_requests_status_priority_deadline "
+                "ON cue_requests (status, priority, deadline)"
+            )
+        )
+        resp_cols = {row[1] for row in conn.execute(text("PRAGMA table_info(cue_responses)"))}
+        if "group_response_id" not in resp_cols:
+            conn.execute(text("ALTER TABLE cue_responses ADD COLUMN group_response_id INTEGER"))
+        conn.execute(
+            text(
+                "CREATE INDEX IF NOT EXISTS ix_cue_responses_group_response_id "
+                "ON cue_responses (group_response_id)"
+            )
+        )
+
+
+def pending_requests_query(*columns):
+    """PENDING requests in serving order: priority desc, earliest deadline, oldest.
+
+    Pass ``columns`` to select only those instead of whole rows.
+    """
+    return (
+        (select(*columns) if columns else select(CueRequest))
+        .where(CueRequest.status == RequestStatus.PENDING)
+        .order_by(
+            CueRequest.priority.desc(),
+            CueRequest.deadline.is_(None),
+            CueRequest.deadline,
+            CueRequest.created_at,
+        )
+    )
+
+
+def create_request(
+    engine: Engine,
+    request_id: str,
+    agent_id: str,
+    prompt: str,
+    payload: str | None = None,
+    priority: int = 0,
+    deadline: datetime | None = None,
+    rendered_payload: str | None = None,
+) -> None:
+    """Insert a PENDING request.
+
+    ``payload`` should already be normalized (payloads.normalize_payload), with
+    its terminal rendering in ``rendered_payload``.
+    """
+    stored_prompt = compress_for(engine, prompt)
+    with engine.begin() as conn:
+        if stored_prompt is not prompt and not has_prompt_index(conn):
+            stored_prompt = prompt  # Keep recall() able to find it
+        conn.execute(
+            _INSERT_REQUEST,
+            {
+                "request_id": request_id,
+                "agent_id": agent_id,
+                "prompt": stored_prompt,
+                "payload": compress_for(engine, payload),
+                "rendered_payload": rendered_payload,
+                "status": RequestStatus.PENDING.value,
+                "priority": int(priority),
+                "deadline": _fmt_ts(deadline) if deadline else None,
+                "now": _now(),
+            },
+        )
+        if stored_prompt is not prompt:
+            index_prompt(conn, request_id, prompt)
+
+
+def respond_request(
+    engine: Engine,
+    request_id: str,
+    response_json: str,
+    *,
+    cancelled: bool,
+    status: RequestStatus,
+) -> bool:
+    """Insert the response (unless one exists) and, if it was inserted, set the request status.
+
+    Returns False when the request was already answered (by the console, the
+    simulator or a timeout); its status is then left as the first answer set it.
+    """
+    now = _now()
+    with engine.begin() as conn:
+        inserted = conn.execute(
+            _INSERT_RESPONSE,
+            {
+                "request_id": request_id,
+                "response_json": compress_for(engine, response_json),
+                "cancelled": bool(cancelled),
+                "now": now,
+            },
+        ).rowcount
+        if inserted != 1:
+            return False
+        conn.execute(
+            _UPDATE_STATUS,
+            {"request_id": request_id, "status": status.value, "now": now},
+        )
+    return True
+
+
+def complete_request(
+    engine: Engine,
+    request_id: str,
+    response: UserResponse,
+    cancelled: bool = False,
+) -> bool:
+    """Record a user response and mark the request COMPLETED."""
+    return respond_request(
+        engine,
+        request_id,
+        response.to_json(),
+        cancelled=cancelled,
+        status=RequestStatus.COMPLETED,
+    )
+
+
+def cancel_request(engine: Engine, request_id: str) -> bool:
+    """Record an empty cancelled response (if none yet) and mark the request CANCELLED."""
+    return respond_request(
+        engine,
+        request_id,
+        _EMPTY_RESPONSE_JSON,
+        cancelled=True,
+        status=RequestStatus.CANCELLED,
+    )
+
+
+def set_request_status(engine: Engine, request_id: str, status: RequestStatus) -> None:
+    """Set the request status without touching the response."""
+    with engine.begin() as conn:
+        conn.execute(
+            _UPDATE_STATUS,
+            {"request_id": request_id, "status": status.value, "now": _now()},
+        )
+
+
+def expire_overdue_requests(engine: Engine) -> int:
+    """Cancel every PENDING request whose deadline has passed. Returns the count."""
+    now = _now()
+    with engine.begin() as conn:
+        conn.execute(_EXPIRE_OVERDUE_RESPONSES, {"response_json": _EMPTY_RESPONSE_JSON, "now": now})
+        return conn.execute(_EXPIRE_OVERDUE_REQUESTS, {"now": now}).rowcount
+
+
+_HAS_PENDING_MEMBER_REQUEST = text(
+    """
+    SELECT 1 FROM cue_requests r
+    JOIN group_members gm ON gm.agent_name = r.agent_id
+    WHERE gm.group_id = :group_id AND r.status = 'PENDING'
+    LIMIT 1
+    """
+)
+
+_HAS_PENDING_AGENT_REQUEST = text(
+    """
+    SELECT 1 FROM cue_requests r
+    WHERE r.agent_id IN :members AND r.status = 'PENDING'
+    LIMIT 1
+    """
+).bindparams(bindparam("members", expanding=True))
+
+_FAN_OUT_RESPONSES = text(
+    """
+    INSERT INTO cue_responses (request_id, response_json, cancelled, group_response_id, created_at)
+    SELECT r.request_id, :response_json, :cancelled, :group_response_id, :now
+    FROM cue_requests r
+    JOIN group_members gm ON gm.agent_name = r.agent_id
+    WHERE gm.group_id = :group_id AND r.status = 'PENDING'
+    ON CONFLICT (request_id) DO NOTHING
+    """
+)
+
+# Same, for a shard: group_members lives in the main DB, so members are passed in.
+_FAN_OUT_RESPONSES_TO_AGENTS = text(
+    """
+    INSERT INTO cue_responses (request_id, response_json, cancelled, group_response_id, created_at)
+    SELECT r.request_id, :response_json, :cancelled, :group_response_id, :now
+    FROM cue_requests r
+    WHERE r.agent_id IN :members AND r.status = 'PENDING'
+    ON CONFLICT (request_id) DO NOTHING
+    """
+).bindparams(bindparam("members", expanding=True))
+
+_FAN_OUT_FILES = text(
+    """
+    INSERT OR IGNORE INTO cue_response_files (response_id, file_id, idx)
+    SELECT resp.id, gf.file_id, gf.idx
+    FROM cue_responses resp
+    JOIN cue_group_response_files gf ON gf.group_response_id = resp.group_response_id
+    WHERE resp.group_response_id = :group_response_id
+    """
+)
+
+_FAN_OUT_STATUS = text(
+    """
+    UPDATE cue_requests SET status = :status, updated_at = :now
+    WHERE request_id IN (
+        SELECT request_id FROM cue_responses WHERE group_response_id = :group_response_id
+    )
+    """
+)
+
+
+def respond_to_group(
+    engine: Engine,
+    group_id: str,
+    response: UserResponse,
+    cancelled: bool = False,
+    members: list[str] | None = None,
+) -> int:
+    """Resolve every PENDING request of a group's members with one shared reply.
+
+    The reply and its images are written once (cue_group_responses +
+    cue_group_response_files); per-request response rows and file links are
+    fanned out with set-based statements in the same transaction.
+    Members come from group_members, or from ``members`` for a shard DB.
+    Nothing is written when no member has a pending request.
+    Returns the number of requests resolved.
+    """
+    if members is not None and not members:
+        return 0
+    now = _now()
+    status = RequestStatus.CANCELLED if cancelled else RequestStatus.COMPLETED
+    # Images live in cue_files; the JSON only carries text (as cue-console writes it).
+    response_json = compress_for(engine, UserResponse(text=response.text).to_json())
+    # Under the write lock, so requests cannot be answered between the check and the fan-out.
+    with immediate_transaction(engine) as conn:
+        pending = conn.execute(
+            _HAS_PENDING_MEMBER_REQUEST if members is None else _HAS_PENDING_AGENT_REQUEST,
+            {"group_id": group_id, "members": members},
+        ).first()
+        if pending is None:
+            return 0
+        group_response_id = conn.execute(
+            text(
+                "INSERT INTO cue_group_responses (group_id, response_json, cancelled, created_at) "
+                "VALUES (:group_id, :response_json, :cancelled, :now)"
+            ),
+            {"group_id": group_id, "response_json": response_json, "cancelled": bool(cancelled), "now": now},
+        ).lastrowid
+        if not cancelled:
+            for idx, img in enumerate(response.images):
+                file_id = upsert_file_from_base64(conn, img.mime_type, img.base64_data)
+                conn.execute(
+                    text(
+                        "INSERT INTO cue_group_response_files (group_response_id, idx, file_id) "
+                        "VALUES (:group_response_id, :idx, :file_id)"
+                    ),
+                    {"group_response_id": group_response_id, "idx": idx, "file_id": file_id},
+                )
+        resolved = conn.execute(
+            _FAN_OUT_RESPONSES if members is None else _FAN_OUT_RESPONSES_TO_AGENTS,
+            {
+                "members": members,
+                "group_id": group_id,
+                "response_json": response_json,
+                "cancelled": bool(cancelled),
+                "group_response_id": group_response_id,
+                "now": now,
+            },
+        ).rowcount
+        if not cancelled:
+            conn.execute(_FAN_OUT_FILES, {"group_response_id": group_response_id})
+        conn.execute(
+            _FAN_OUT_STATUS,
+            {"group_response_id": group_response_id, "status": status.value, "now": now},
+        )
+    return resolved
+
+
+def _queue_ts(value: datetime) -> str:
+    # cue-console stores queue timestamps as local ISO 8601 with offset and compares them as text.
+    return value.astimezone().isoformat(timespec="milliseconds")
+
+
+_SELECT_DUE_QUEUE_ITEM = text(
+    """
+    SELECT id FROM cue_message_queue
+    WHERE conv_type = 'agent' AND conv_id = :agent_id
+      AND status = 'queued' AND next_run_at <= :now
+    ORDER BY position ASC, created_at ASC
+    LIMIT 1
+    """
+)
+
+_CLAIM_QUEUE_ITEM = text(
+    """
+    UPDATE cue_message_queue
+    SET status = 'processing', locked_by = :worker, locked_at = :now, updated_at = :now
+    WHERE id = :id AND status = 'queued' AND (locked_at IS NULL OR locked_at <= :lock_cutoff)
+    """
+)
+
+_FAIL_QUEUE_ITEM = text(
+    """
+    UPDATE cue_message_queue
+    SET status = 'queued', locked_by = NULL, locked_at = NULL,
+        attempts = attempts + 1, next_run_at = :next_run_at, updated_at = :now
+    WHERE id = :id AND locked_by = :worker
+    """
+)
+
+_RELEASE_QUEUE_ITEM = text(
+    """
+    UPDATE cue_message_queue
+    SET status = 'queued', locked_by = NULL, locked_at = NULL, updated_at = :now
+    WHERE id = :id AND locked_by = :worker
+    """
+)
+
+
+def claim_queued_message(engine: Engine, agent_id: str) -> tuple[str, str] | None:
+    """Claim the next due queued console message for an agent.
+
+    Returns (queue id, message_json), or None if nothing is due (or the console
+    has never created the queue table).
+    """
+    now = datetime.now()
+    try:
+        with engine.begin() as conn:
+            row = conn.execute(
+                _SELECT_DUE_QUEUE_ITEM, {"agent_id": agent_id, "now": _queue_ts(now)}
+            ).fetchone()
+            if row is None:
+                return None
+            claimed = conn.execute(
+                _CLAIM_QUEUE_ITEM,
+                {
+                    "id": row[0],
+                    "worker": QUEUE_WORKER_ID,
+                    "now": _queue_ts(now),
+                    "lock_cutoff": _queue_ts(now - QUEUE_LOCK_TTL),
+                },
+            ).rowcount
+            if claimed != 1:
+                return None
+            message_json = conn.execute(
+                text("SELECT message_json FROM cue_message_queue WHERE id = :id"), {"id": row[0]}
+            ).scalar_one()
+    except OperationalError:
+        # No cue_message_queue table yet, or the console holds the write lock.
+        return None
+    return str(row[0]), str(message_json or "{}")
+
+
+def release_queued_message(engine: Engine, queue_id: str) -> None:
+    """Give a claimed queue item back untouched (no attempt counted), e.g. when it was not used."""
+    with engine.begin() as conn:
+        conn.execute(
+            _RELEASE_QUEUE_ITEM,
+            {"id": queue_id, "worker": QUEUE_WORKER_ID, "now": _queue_ts(datetime.now())},
+        )
+
+
+def _settle_queue_item(conn: Connection, queue_id: str, delivered: bool) -> None:
+    if delivered:
+        conn.execute(text("DELETE FROM cue_message_queue WHERE id = :id"), {"id": queue_id})
+    else:
+        conn.execute(
+            _RELEASE_QUEUE_ITEM,
+            {"id": queue_id, "worker": QUEUE_WORKER_ID, "now": _queue_ts(datetime.now())},
+        )
+
+
+def _settle_queue_item_after_commit(engine: Engine, queue_id: str, request_id: str, delivered: bool) -> None:
+    """Settle a queue item whose reply is already committed in another DB.
+
+    Retried, because a delivered item left 'processing' is claimed again by the
+    console's worker once its lock expires, and the message would arrive twice.
+    """
+    for attempt in range(QUEUE_SETTLE_ATTEMPTS):
+        try:
+            with engine.begin() as conn:
+                _settle_queue_item(conn, queue_id, delivered)
+            return
+        except OperationalError as e:
+            error = e
+            time.sleep(0.2 * (attempt + 1))
+    if delivered:
+        print(
+            f"[MCP] Queued message {queue_id} WAS DELIVERED (as the reply to {request_id}) but could not be "
+            f"removed from cue_message_queue: {error}. Delete it, or it is delivered again after "
+            f"{int(QUEUE_LOCK_TTL.total_seconds())}s."
+        )
+    else:
+        print(f"[MCP] Could not release queued message {queue_id}: {error}; it is retried after the lock expires")
+
+
+def answer_from_queued_message(
+    engine: Engine,
+    request_id: str,
+    queue_id: str,
+    message_json: str,
+    queue_engine: Engine | None = None,
+) -> bool:
+    """Answer a request with a claimed queue message, link its images, drop the queue item.
+
+    Returns False if the request was already answered; the claim is then
+    released so the message goes to the agent's next request. On failure the
+    claim is released with attempts + 1 and a backoff, like the console's worker.
+
+    ``queue_engine`` is the DB holding cue_message_queue when it differs from
+    the request's DB (a shard). The queue item is then settled right after the
+    response is committed rather than in the same transaction, with retries.
+    """
+    queue_engine = queue_engine or engine
+    try:
+        message = codec.loads(message_json or "{}")
+        if not isinstance(message, dict):
+            message = {}
+        msg_text = message.get("text") if isinstance(message.get("text"), str) else ""
+        images = message.get("images") if isinstance(message.get("images"), list) else []
+        mentions = message.get("mentions") if isinstance(message.get("mentions"), list) else []
+        normalized: dict = {"text": msg_text}
+        if mentions:
+            normalized["mentions"] = mentions
+
+        now = _now()
+        with engine.begin() as conn:
+            delivered = conn.execute(
+                _INSERT_RESPONSE,
+                {
+                    "request_id": request_id,
+                    "response_json": compress_for(engine, codec.dumps(normalized)),
+                    "cancelled": False,
+                    "now": now,
+                },
+            ).rowcount == 1
+            if delivered:
+                response_id = conn.execute(
+                    text("SELECT id FROM cue_responses WHERE request_id = :request_id"),
+                    {"request_id": request_id},
+                ).scalar_one()
+                for idx, img in enumerate(images):
+                    if not isinstance(img, dict) or not img.get("base64_data"):
+                        continue
+                    file_id = upsert_file_from_base64(
+                        conn, str(img.get("mime_type") or ""), str(img["base64_data"])
+                    )
+                    conn.execute(
+                        text(
+                            "INSERT INTO cue_response_files (response_id, file_id, idx) "
+                            "VALUES (:response_id, :file_id, :idx)"
+                        ),
+                        {"response_id": response_id, "file_id": file_id, "idx": idx},
+                    )
+                conn.execute(
+                    _UPDATE_STATUS,
+                    {"request_id": request_id, "status": RequestStatus.COMPLETED.value, "now": now},
+                )
+            if queue_engine is engine:
+                _settle_queue_item(conn, queue_id, delivered)
+    except Exception:
+        with queue_engine.begin() as conn:
+            attempts = conn.execute(
+                text("SELECT attempts FROM cue_message_queue WHERE id = :id"), {"id": queue_id}
+            ).scalar() or 0
+            backoff = min(60.0, max(1.0, 2.0 ** (int(attempts) + 1)))
+            now_dt = datetime.now()
+            conn.execute(
+                _FAIL_QUEUE_ITEM,
+                {
+                    "id": queue_id,
+                    "worker": QUEUE_WORKER_ID,
+                    "now": _queue_ts(now_dt),
+                    "next_run_at": _queue_ts(now_dt + timedelta(seconds=backoff)),
+                },
+            )
+        raise
+    if queue_engine is not engine:
+        _settle_queue_item_after_commit(queue_engine, queue_id, request_id, delivered)
+    return delivered
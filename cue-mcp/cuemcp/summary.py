@@ -0,0 +1,177 @@
+"""Per-agent summary table (agent_summaries) kept current by SQLite triggers.
+
+Triggers (rather than the Python write path) keep the table correct no matter
+who writes: cuemcp, cueme or cue-console. Listing agents then reads one row
+per agent instead of aggregating over the full request/response history.
+"""
+import argparse
+from pathlib import Path
+
+from sqlalchemy import create_engine, text
+from sqlalchemy.engine import Connection, Engine
+from sqlalchemy.schema import CreateTable
+from sqlmodel import Session, select
+
+from .models import AgentSummary
+from .store import immediate_transaction
+
+DEFAULT_DB_PATH = Path.home() / ".cue/cue.db"
+
+_TRIGGERS = {
+    "trg_agent_summaries_request_insert": """
+        CREATE TRIGGER IF NOT EXISTS trg_agent_summaries_request_insert
+        AFTER INSERT ON cue_requests
+        BEGIN
+            INSERT INTO agent_summaries
+                (agent_id, last_request_pk, last_request_id, last_request_at, last_status,
+                 pending_count, total_count)
+            VALUES
+                (NEW.agent_id, NEW.id, NEW.request_id, NEW.created_at, NEW.status,
+                 NEW.status = 'PENDING', 1)
+            ON CONFLICT (agent_id) DO UPDATE SET
+                total_count = total_count + 1,
+                pending_count = pending_count + (NEW.status = 'PENDING'),
+                last_request_pk = MAX(last_request_pk, NEW.id),
+                last_request_id = CASE WHEN NEW.id >= last_request_pk THEN NEW.request_id ELSE last_request_id END,
+                last_request_at = CASE WHEN NEW.id >= last_request_pk THEN NEW.created_at ELSE last_request_at END,
+                last_status = CASE WHEN NEW.id >= last_request_pk THEN NEW.status ELSE last_status END;
+        END
+    """,
+    "trg_agent_summaries_request_status": """
+        CREATE TRIGGER IF NOT EXISTS trg_agent_summaries_request_status
+        AFTER UPDATE OF status ON cue_requests
+        WHEN OLD.status IS NOT NEW.status
+        BEGIN
+            UPDATE agent_summaries SET
+                pending_count = pending_count + (NEW.status = 'PENDING') - (OLD.status = 'PENDING'),
+                last_status = CASE WHEN last_request_pk = NEW.id THEN NEW.status ELSE last_status END
+            WHERE agent_id = NEW.agent_id;
+        END
+    """,
+    "trg_agent_summaries_request_delete": """
+        CREATE TRIGGER IF NOT EXISTS trg_agent_summaries_request_delete
+        AFTER DELETE ON cue_requests
+        BEGIN
+            UPDATE agent_summaries SET
+                total_count = total_count - 1,
+                pending_count = pending_count - (OLD.status = 'PENDING')
+            WHERE agent_id = OLD.agent_id;
+            UPDATE agent_summaries SET
+                last_request_pk = COALESCE(
+                    (SELECT MAX(id) FROM cue_requests WHERE agent_id = OLD.agent_id), 0),
+                last_request_id = COALESCE(
+                    (SELECT request_id FROM cue_requests WHERE agent_id = OLD.agent_id ORDER BY id DESC LIMIT 1), ''),
+                last_request_at =
+                    (SELECT created_at FROM cue_requests WHERE agent_id = OLD.agent_id ORDER BY id DESC LIMIT 1),
+                last_status = COALESCE(
+                    (SELECT status FROM cue_requests WHERE agent_id = OLD.agent_id ORDER BY id DESC LIMIT 1), '')
+            WHERE agent_id = OLD.agent_id AND last_request_pk = OLD.id;
+            DELETE FROM agent_summaries WHERE agent_id = OLD.agent_id AND total_count <= 0;
+        END
+    """,
+    "trg_agent_summaries_response_insert": """
+        CREATE TRIGGER IF NOT EXISTS trg_agent_summaries_response_insert
+        AFTER INSERT ON cue_responses
+        BEGIN
+            UPDATE agent_summaries SET last_response_at = NEW.created_at
+            WHERE agent_id = (SELECT agent_id FROM cue_requests WHERE request_id = NEW.request_id);
+        END
+    """,
+}
+
+_REBUILD = text(
+    """
+    INSERT INTO agent_summaries
+        (agent_id, last_request_pk, last_request_id, last_request_at, last_status,
+         last_response_at, pending_count, total_count)
+    SELECT agg.agent_id, agg.last_pk, last.request_id, last.created_at, last.status,
+           (SELECT MAX(resp.created_at)
+            FROM cue_responses resp
+            JOIN cue_requests r ON r.request_id = resp.request_id
+            WHERE r.agent_id = agg.agent_id),
+           agg.pending, agg.total
+    FROM (
+        SELECT agent_id, MAX(id) AS last_pk, SUM(status = 'PENDING') AS pending, COUNT(*) AS total
+        FROM cue_requests
+        GROUP BY agent_id
+    ) agg
+    JOIN cue_requests last ON last.id = agg.last_pk
+    """
+)
+
+
+def _rebuild(conn: Connection) -> int:
+    conn.execute(text("DELETE FROM agent_summaries"))
+    conn.execute(_REBUILD)
+    return int(conn.execute(text("SELECT COUNT(*) FROM agent_summaries")).scalar() or 0)
+
+
+def ensure_agent_summaries(engine: Engine) -> None:
+    """Install missing triggers; on first install, backfill from history in the same transaction.
+
+    Runs under the write lock: concurrent cuemcp starts must not both install
+    (or both backfill).
+    """
+    with immediate_transaction(engine) as conn:
+        conn.execute(CreateTable(AgentSummary.__table__, if_not_exists=True))
+        existing = {
+            row[0]
+            for row in conn.execute(
+                text("SELECT name FROM sqlite_master WHERE type = 'trigger' AND tbl_name IN ('cue_requests', 'cue_responses')")
+            )
+        }
+        missing = [name for name in _TRIGGERS if name not in existing]
+        if not missing:
+            return
+        for name in missing:
+            conn.execute(text(_TRIGGERS[name]))
+        _rebuild(conn)
+
+
+def rebuild_agent_summaries(engine: Engine) -> int:
+    """Recompute agent_summaries from cue_requests/cue_responses. Returns the agent count."""
+    ensure_agent_summaries(engine)
+    with engine.begin() as conn:
+        return _rebuild(conn)
+
+
+def list_agent_summaries(engine: Engine, *, pending_only: bool = False) -> list[AgentSummary]:
+    """Agents ordered by latest request first."""
+    stmt = select(AgentSummary)
+    if pending_only:
+        stmt = stmt.where(AgentSummary.pending_count > 0)
+    stmt = stmt.order_by(AgentSummary.last_request_pk.desc())
+    with Session(engine) as session:
+        return list(session.exec(stmt).all())
+
+
+def has_pending(engine: Engine) -> bool:
+    """Whether any agent has a PENDING request (reads agent_summaries, not history)."""
+    with engine.connect() as conn:
+        return conn.execute(
+            text("SELECT 1 FROM agent_summaries WHERE pending_count > 0 LIMIT 1")
+        ).fetchone() is not None
+
+
+def main(argv: list[str] | None = None) -> None:
+    parser = argparse.ArgumentParser(
+        prog="cuemcp rebuild-summaries",
+        description="Rebuild the per-agent summary table (agent_summaries) from history.",
+    )
+    parser.add_argument("--db", default=str(DEFAULT_DB_PATH), help="SQLite DB path (default: ~/.cue/cue.db)")
+    args = parser.parse_args(argv)
+
+    db_path = Path(args.db).expanduser()
+    if not db_path.exists():
+        parser.error(f"database not found: {db_path}")
+
+    engine = create_engine(f"sqlite:///{db_path}", echo=False)
+    try:
+        count = rebuild_agent_summaries(engine)
+    finally:
+        engine.dispose()
+    print(f"[MCP] Rebuilt agent_summaries for {count} agents")
+
+
+if __name__ == "__main__":
+    main()
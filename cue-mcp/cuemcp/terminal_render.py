@@ -1,14 +1,23 @@
 import json
 from typing import Any
 
+from .codec import parse_payload
 
-def render_payload(payload: str, *, debug: bool = False) -> str:
-    """Render cue payload (JSON string) into human-friendly terminal text."""
+
+def render_payload(payload: str, *, debug: bool = False, request_id: str | None = None) -> str:
+    """Render cue payload (JSON string) into human-friendly terminal text.
+
+    Pass request_id to reuse the parsed payload across repeated renders.
+    """
     try:
-        parsed: Any = json.loads(payload)
+        parsed: Any = parse_payload(payload, request_id)
     except Exception:
         return payload
+    return render_parsed(parsed, debug=debug)
+
 
+def render_parsed(parsed: Any, *, debug: bool = False) -> str:
+    """Render an already-parsed payload."""
     if not isinstance(parsed, dict):
         return _maybe_debug("Structured data", parsed, debug=debug)
 
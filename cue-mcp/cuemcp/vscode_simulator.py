@@ -5,14 +5,17 @@ Polls the database and handles user requests.
 """
 import asyncio
 import base64
-import json
 import mimetypes
-from datetime import datetime, timezone
+from datetime import datetime
 from pathlib import Path
 
-from sqlmodel import Session, create_engine, select, SQLModel
+from sqlalchemy.engine import Engine, Row
+from sqlmodel import Session, create_engine, SQLModel
 
-from .models import CueRequest, CueResponse, ImageContent, RequestStatus, UserResponse
+from .models import CueRequest, ImageContent, UserResponse
+from .store import complete_request, ensure_request_schema, expire_overdue_requests, pending_requests_query
+from .routing import ShardRouter
+from .summary import ensure_agent_summaries, has_pending, list_agent_summaries
 from .terminal_render import render_payload
 
 try:
@@ -29,6 +32,11 @@ DATABASE_URL = f"sqlite:///{DB_PATH}"
 
 engine = create_engine(DATABASE_URL, echo=False)
 SQLModel.metadata.create_all(engine)
+ensure_request_schema(engine)
+ensure_agent_summaries(engine)
+
+# Also serves per-project shards when CUE_SHARDING=1
+router = ShardRouter(engine)
 
 
 def _read_multiline_text() -> str:
@@ -109,30 +117,63 @@ async def poll_requests():
     print(f"📁 Database: {DB_PATH}\n")
 
     while True:
-        with Session(engine) as session:
-            # Find the first pending request
-            request = session.exec(
-                select(CueRequest)
-                .where(CueRequest.status == RequestStatus.PENDING)
-                .order_by(CueRequest.created_at)
-            ).first()
-
+        # Find the most urgent pending request across shards (priority, then deadline, then age)
+        best: tuple[Row, Engine] | None = None
+        for db_engine in router.all_engines():
+            # Shards with nothing pending cost one summary row read
+            if not has_pending(db_engine):
+                continue
+
+            # Requests past their deadline are not worth showing
+            expire_overdue_requests(db_engine)
+
+            # Compare heads on the ordering columns; only the winner's text is loaded (and decompressed)
+            with Session(db_engine) as session:
+                head = session.exec(
+                    pending_requests_query(
+                        CueRequest.id, CueRequest.priority, CueRequest.deadline, CueRequest.created_at
+                    )
+                ).first()
+            if head and (best is None or _urgency(head) < _urgency(best[0])):
+                best = (head, db_engine)
+
+        if best:
+            head, db_engine = best
+            with Session(db_engine) as session:
+                request = session.get(CueRequest, head.id)
             if request:
                 # Handle request
-                await handle_request(request)
+                await handle_request(request, db_engine)
 
         # Check every 500ms
         await asyncio.sleep(0.5)
 
 
-async def handle_request(request: CueRequest):
+def _urgency(request: CueRequest | Row) -> tuple:
+    # Same order as pending_requests_query, for comparing heads of different shards
+    return (
+        -request.priority,
+        request.deadline is None,
+        request.deadline or datetime.max,
+        request.created_at,
+    )
+
+
+async def handle_request(request: CueRequest, db_engine: Engine = engine):
     """Handle a single request."""
     print("=" * 60)
     print(f"📨 New request: {request.request_id}")
+    waiting = [a for e in router.all_engines() for a in list_agent_summaries(e, pending_only=True)]
+    if waiting:
+        print("📬 Waiting: " + ", ".join(f"{a.agent_id or '<unknown>'} ({a.pending_count})" for a in waiting))
     print(f"📝 Prompt: {request.prompt}")
-    if request.payload:
+    if request.rendered_payload:
+        # Rendered once when cue() validated the payload
+        print(request.rendered_payload)
+    elif request.payload:
+        # Requests created by other writers (cueme, older cuemcp)
         try:
-            print(render_payload(request.payload, debug=False))
+            print(render_payload(request.payload, debug=False, request_id=request.request_id))
         except Exception:
             print("🧩 Payload (raw):")
             print(request.payload)
@@ -148,25 +189,17 @@ async def handle_request(request: CueRequest):
     # Create response object
     user_response = UserResponse(text=user_text, images=images)
 
-    # Write response
-    with Session(engine) as session:
-        response = CueResponse.create(
-            request_id=request.request_id,
-            response=user_response,
-            cancelled=(not user_text and not images)
-        )
-        session.add(response)
-
-        # Update request status
-        db_request = session.get(CueRequest, request.id)
-        if db_request:
-            db_request.status = RequestStatus.COMPLETED
-            db_request.updated_at = datetime.now(timezone.utc)
-            session.add(db_request)
-
-        session.commit()
-
-    if user_text:
+    # Write response and update request status in one transaction
+    answered = complete_request(
+        db_engine,
+        request.request_id,
+        user_response,
+        cancelled=(not user_text and not images),
+    )
+
+    if not answered:
+        print("⚠️ Request was already answered (or timed out); reply not recorded\n")
+    elif user_text:
         print(f"✅ Response sent: {user_text[:50]}{'...' if len(user_text) > 50 else ''}\n")
     else:
         print("✅ End signal sent\n")